@@ -1,5 +1,6 @@
 # enhanced_app.py
 import time
+import logging
 import os, tempfile, zipfile, io,base64
 import streamlit as st
 import pandas as pd
@@ -12,7 +13,7 @@ from rag_index import build_faiss_index, load_index, query
 from io import BytesIO
 from docx import Document
 from brd_generator import (
-    generate_brd,
+    generate_brd_stream,
     generate_complexity_analysis,
     generate_business_process_flows,
     generate_power_platform_detailed_mapping,
@@ -30,6 +31,7 @@ from brd_generator import (
 from graph_store import GraphStore
 
 load_dotenv()
+logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler()])
 st.set_page_config(
     page_title=".NET to Power Platform Modernization", 
     page_icon="⚡", 
@@ -677,17 +679,17 @@ with tab4:
                     # status.text("Generating Business Flows...")
                     status_placeholder.text("Generating Business Requirements Document...")
                     print('before generate brd')
-                    brd_content = generate_brd(
+                    st.subheader("📋 Business Requirements Document")
+                    status_placeholder.text("")
+                    # Render the BRD as it is written instead of after the whole response
+                    brd_content = st.write_stream(generate_brd_stream(
                         seed_results,
                         parsed["nodes"],
                         parsed.get("metrics"),
                         parsed.get("business_processes"),
                         power_mapping
-                    )
+                    ))
                     print('after generate brd')
-                    st.subheader("📋 Business Requirements Document")
-                    status_placeholder.text("")
-                    st.markdown(brd_content)
                     
                     # Download options
                     col1, col2, col3 = st.columns(3)
@@ -2,11 +2,25 @@
 # Includes: BRD generation, validation, business rules extraction, API contracts
 
 import os
-import json
+import asyncio
 import re
-from typing import Dict, List, Any
+import functools
+import hashlib
+import logging
+import textwrap
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Any, Optional, Tuple
+import diskcache
+import httpx
+import orjson
+import tiktoken
 from openai import AzureOpenAI
+from pydantic import BaseModel
 from docx import Document
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
 from io import BytesIO
 from dotenv import load_dotenv
 from prompts import (
@@ -20,22 +34,242 @@ from prompts import (
 
 load_dotenv()
 
-client = AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    api_version="2024-12-01-preview"
-)
+logger = logging.getLogger(__name__)
+
 CHAT_DEPLOY = os.getenv("AZURE_OPENAI_DEPLOYMENT")
+# Cheaper deployment (e.g. gpt-4o-mini) for template-heavy Tab 6 documents;
+# falls back to the main deployment when not configured
+CHEAP_CHAT_DEPLOY = os.getenv("AZURE_OPENAI_CHEAP_DEPLOYMENT") or CHAT_DEPLOY
+
+# Longest code snippet sent to the extraction prompts
+MAX_SAMPLE_SNIPPET_CHARS = 2000
+# Below this much candidate code, rule extraction is not worth an LLM call
+MIN_RULE_CANDIDATE_CHARS = 500
+# Markers of an actual outbound HTTP request (as opposed to [HttpGet] attributes)
+OUTBOUND_HTTP_CALLS = (
+    'SendAsync', 'PostAsync', 'GetAsync', 'PutAsync', 'DeleteAsync', 'ExecuteAsync',
+    'DownloadString', 'UploadString', 'fetch(', 'axios.'
+)
+
+# LLM response cache: identical prompts skip the network round-trip
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", ".llm_cache")
+LLM_CACHE_TTL = 7 * 24 * 60 * 60  # seconds
+LLM_MEMORY_CACHE_SIZE = 256
+
+# Tab 6 documents generated at once by generate_analysis_documents (they
+# share one deployment and its requests-per-minute limit)
+DOCUMENT_MAX_CONCURRENCY = 4
+
+# Context snippet token budget per document: summary-style documents need
+# far less grounding than the full BRD
+CONTEXT_TOKEN_BUDGETS = {
+    "brd": 4000,
+    "flows": 2000,
+    "tables": 2000,
+    "test_cases": 2000,
+    "journeys": 1250,
+    "personas": 1250,
+    "copilot": 750,  # roughly the 3000 characters the prompt used to keep
+}
+
+
+# Rough characters per token for English text and code, used without tiktoken
+CHARS_PER_TOKEN = 4
+
+
+@functools.lru_cache(maxsize=1)
+def _encoding() -> Optional["tiktoken.Encoding"]:
+    """
+    Tokenizer used to budget prompt context by real token count (thread-safe,
+    reused). Loaded on first use: tiktoken may download its BPE file, which
+    must not happen at import time. None when that download fails (offline);
+    callers then budget by characters instead.
+    """
+    try:
+        return tiktoken.encoding_for_model("gpt-4o")
+    except Exception as e:
+        logger.warning("⚠️  tiktoken encoding unavailable, budgeting context by characters: %r", e)
+        return None
+
+
+# JSON inside a ```json fenced block of an LLM response
+_FENCED_JSON_RE = re.compile(r'```(?:json)?\s*(.*?)\s*```', re.DOTALL)
+
+
+# ============================================================
+# Azure OpenAI Client (created lazily on first use)
+# ============================================================
+_client = None
+
+
+def _get_client() -> AzureOpenAI:
+    """Return the shared Azure OpenAI client, creating it on first call"""
+    global _client
+    if _client is None:
+        _client = AzureOpenAI(
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            api_version="2024-12-01-preview",
+            http_client=httpx.Client(limits=httpx.Limits(max_keepalive_connections=20))
+        )
+    return _client
+
+
+# ============================================================
+# LLM Response Cache (memory in front of disk)
+# ============================================================
+_llm_disk_cache = None
+_llm_memory_cache: Dict[bytes, str] = {}
 
 
-def _chat(messages, temperature: float = 0.1):
-    """Helper function to call Azure OpenAI"""
-    resp = client.chat.completions.create(
-        model=CHAT_DEPLOY,
+def _get_llm_disk_cache() -> diskcache.Cache:
+    """Return the on-disk LLM response cache, opening it on first call"""
+    global _llm_disk_cache
+    if _llm_disk_cache is None:
+        _llm_disk_cache = diskcache.Cache(LLM_CACHE_DIR)
+    return _llm_disk_cache
+
+
+def _remember_response(key: bytes, content: str) -> None:
+    """Keep a response in the in-process cache, dropping the oldest when full"""
+    if len(_llm_memory_cache) >= LLM_MEMORY_CACHE_SIZE:
+        _llm_memory_cache.pop(next(iter(_llm_memory_cache)), None)
+    _llm_memory_cache[key] = content
+
+
+def _llm_cache_key(messages, temperature: float, model: str, schema: type = None) -> bytes:
+    """Cache key for a chat call: deployment, messages, temperature and any response schema"""
+    request = {"model": model, "messages": messages, "temperature": temperature}
+    if schema is not None:
+        request["schema"] = schema.model_json_schema()
+    return _content_key(request)
+
+
+def _cached_response(key: bytes):
+    """Look a response up in memory, then on disk; None on a miss"""
+    cached = _llm_memory_cache.get(key)
+    if cached is None:
+        cached = _get_llm_disk_cache().get(key)
+        if cached is not None:
+            _remember_response(key, cached)
+    return cached
+
+
+def _store_response(key: bytes, content: str) -> None:
+    """Store a non-empty response in both cache layers"""
+    if content:
+        _remember_response(key, content)
+        _get_llm_disk_cache().set(key, content, expire=LLM_CACHE_TTL)
+
+
+def _user_msg(content: str) -> str:
+    """
+    Normalise a user-message payload: drop common indentation and surrounding
+    blank lines, which are billed as tokens and make otherwise identical
+    prompts miss the prompt and response caches.
+    """
+    return textwrap.dedent(content).strip()
+
+
+def _chat(messages, temperature: float = 0.1, model: str = None):
+    """Helper function to call Azure OpenAI (responses cached by prompt)"""
+    model = model or CHAT_DEPLOY
+    key = _llm_cache_key(messages, temperature, model)
+    cached = _cached_response(key)
+    if cached is not None:
+        return cached
+    
+    resp = _get_client().chat.completions.create(
+        model=model,
         messages=messages,
         temperature=temperature,
     )
-    return resp.choices[0].message.content
+    content = resp.choices[0].message.content
+    _store_response(key, content)
+    return content
+
+
+def _chat_parsed(messages, schema: type, temperature: float = 0.1, model: str = None):
+    """
+    Structured-output _chat: the reply parsed into the pydantic model schema.
+    Cached like _chat, as the model's JSON.
+    """
+    model = model or CHAT_DEPLOY
+    key = _llm_cache_key(messages, temperature, model, schema)
+    cached = _cached_response(key)
+    if cached is not None:
+        return schema.model_validate_json(cached)
+    
+    resp = _get_client().beta.chat.completions.parse(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        response_format=schema,
+    )
+    parsed = resp.choices[0].message.parsed
+    if parsed is None:
+        raise ValueError("Model returned no structured output")
+    _store_response(key, parsed.model_dump_json())
+    return parsed
+
+
+def _chat_stream(messages, temperature: float = 0.1, model: str = None):
+    """
+    Streaming _chat: yield the response text as it arrives. A cached response
+    is yielded in one piece; a fresh one is cached once the stream closes.
+    """
+    model = model or CHAT_DEPLOY
+    key = _llm_cache_key(messages, temperature, model)
+    cached = _cached_response(key)
+    if cached is not None:
+        yield cached
+        return
+    
+    stream = _get_client().chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        stream=True,
+    )
+    pieces = []
+    for chunk in stream:
+        # Azure sends a leading chunk with no choices (content filter results)
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            pieces.append(delta)
+            yield delta
+    _store_response(key, ''.join(pieces))
+
+
+# Markdown heading marker -> Word heading level
+_HEADING_LEVELS = {"#": 1, "##": 2, "###": 3}
+
+
+def _append_plain_paragraph(doc: Document, text: str) -> None:
+    """
+    Append an unstyled paragraph as raw <w:p> XML, skipping the python-docx
+    proxy objects that make add_paragraph slow on very large BRDs.
+    """
+    if "\t" in text:
+        # add_paragraph converts tabs to <w:tab/> elements
+        doc.add_paragraph(text)
+        return
+    p = OxmlElement("w:p")
+    if text:
+        r = OxmlElement("w:r")
+        t = OxmlElement("w:t")
+        t.set(qn("xml:space"), "preserve")
+        t.text = text
+        r.append(t)
+        p.append(r)
+    body = doc.element.body
+    sect_pr = body.sectPr
+    if sect_pr is not None:
+        sect_pr.addprevious(p)  # section properties must stay last in the body
+    else:
+        body.append(p)
 
 
 def generate_word_brd(content: str, name: str) -> BytesIO:
@@ -50,13 +284,11 @@ def generate_word_brd(content: str, name: str) -> BytesIO:
     lines = content.split("\n")
     for line in lines:
         line = line.strip()
-        if line.startswith("### "):
-            doc.add_heading(line[4:], level=3)
-        elif line.startswith("## "):
-            doc.add_heading(line[3:], level=2)
-        elif line.startswith("# "):
-            doc.add_heading(line[2:], level=1)
-        elif line.startswith("|"):  # Table detection
+        first, sep, rest = line.partition(" ")
+        level = _HEADING_LEVELS.get(first) if sep else None
+        if level:
+            doc.add_heading(rest, level=level)
+        elif line[:1] == "|":  # Table detection
             # Simple table parsing
             cells = [c.strip() for c in line.split("|") if c.strip()]
             if cells:
@@ -72,7 +304,7 @@ def generate_word_brd(content: str, name: str) -> BytesIO:
                     for i, cell in enumerate(cells):
                         row_cells[i].text = cell
         else:
-            doc.add_paragraph(line)
+            _append_plain_paragraph(doc, line)
             if hasattr(doc, "_current_table"):
                 delattr(doc, "_current_table")
     
@@ -83,14 +315,20 @@ def generate_word_brd(content: str, name: str) -> BytesIO:
     return buffer
 
 
+def _content_key(data: Any) -> bytes:
+    """Stable 16-byte digest of JSON-like data, used as a cache key"""
+    payload = orjson.dumps(data, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=str)
+    return hashlib.blake2b(payload, digest_size=16).digest()
+
+
 def summarize_graph_enhanced(nodes: List[Dict[str, Any]]) -> str:
     """Enhanced graph summary with detailed component analysis"""
-    counts = {}
+    counts = Counter()
     complexity_by_type = {}
     
     for n in nodes or []:
         kind = n["kind"]
-        counts[kind] = counts.get(kind, 0) + 1
+        counts[kind] += 1
         
         # Aggregate complexity metrics if available
         if "props" in n and "complexity" in n.get("props", {}):
@@ -98,7 +336,8 @@ def summarize_graph_enhanced(nodes: List[Dict[str, Any]]) -> str:
                 complexity_by_type[kind] = []
             complexity_by_type[kind].append(n["props"]["complexity"])
     
-    lines = [f"- {k}: {v}" for k, v in sorted(counts.items())]
+    # Most frequent kinds first so the model sees the dominant components early
+    lines = [f"- {k}: {v}" for k, v in counts.most_common()]
     
     # Add complexity summary
     if complexity_by_type:
@@ -261,8 +500,9 @@ def format_power_platform_mapping(mapping: Dict[str, Any]) -> str:
     return summary
 
 
-def _make_context_snippets(results: List[Dict[str, Any]], max_chars: int = 12000) -> str:
-    """Enhanced context snippets with metrics information"""
+def _make_context_snippets(results: List[Dict[str, Any]], max_tokens: int = 4000) -> str:
+    """Enhanced context snippets with metrics information, capped at max_tokens"""
+    enc = _encoding()
     parts, total = [], 0
     for r in results or []:
         tag = f"[{r.get('meta',{}).get('path','?')}]"
@@ -274,43 +514,74 @@ def _make_context_snippets(results: List[Dict[str, Any]], max_chars: int = 12000
             metrics_info = f" (LOC: {m.get('lines', '?')}, Complexity: {m.get('complexity', '?')})"
         
         piece = f"{tag}{metrics_info}\n{(r['text'] or '').strip()}\n"
-        if total + len(piece) > max_chars: 
+        if enc is None:
+            # No tokenizer: treat each CHARS_PER_TOKEN characters as one token
+            toks = [piece[i:i + CHARS_PER_TOKEN] for i in range(0, len(piece), CHARS_PER_TOKEN)]
+        else:
+            toks = enc.encode(piece)
+        if total + len(toks) > max_tokens:
+            # Fill the remaining budget with the head of this snippet
+            remaining = max_tokens - total
+            if remaining > 0:
+                parts.append("".join(toks[:remaining]) if enc is None else enc.decode(toks[:remaining]))
             break
         parts.append(piece)
-        total += len(piece)
+        total += len(toks)
     return "\n---\n".join(parts)
 
 
+def _join_code_samples(snippets: List[str], max_chars: int, separator: str, suffix: str = "") -> str:
+    """Truncate each snippet to max_chars and join them with separator"""
+    return separator.join(
+        snippet[:max_chars] + suffix if len(snippet) > max_chars else snippet
+        for snippet in snippets
+    )
+
+
+def _dumps_indented(data: Any) -> str:
+    """Pretty-print JSON for BRD code blocks (orjson, 2-space indent)"""
+    return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS, default=str).decode()
+
+
+def _scan_balanced(text: str, open_c: str, close_c: str) -> Optional[str]:
+    """
+    Return the first balanced {...} or [...] block in text, or None.
+    Single pass over the text; quote state is tracked from the first
+    character, so braces inside strings (also before the block) are ignored.
+    """
+    depth, start = 0, -1
+    in_str = esc = False
+    for i, ch in enumerate(text):
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == '\\':
+                esc = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch == open_c:
+            if depth == 0:
+                start = i
+            depth += 1
+        elif ch == close_c and depth > 0:
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+
 # ============================================================
 # ✅ NEW: VALIDATION & CONFIDENCE SCORING
 # ============================================================
 
-def validate_and_score_extraction(
-    parsed_data: Dict[str, Any],
-    sample_code_snippets: List[str]
-) -> Dict[str, Any]:
-    """
-    Use GPT-4 to validate extracted data against actual code.
-    Returns confidence scores and flags items needing manual review.
-    
-    Args:
-        parsed_data: Dict with power_platform_mapping, business_processes
-        sample_code_snippets: List of code strings to validate against
-        
-    Returns:
-        {
-            "entities": {"completeness": 0.X, "accuracy": 0.X, "confidence": 0.X, "missing": [...]},
-            "processes": {"completeness": 0.X, "accuracy": 0.X, "confidence": 0.X, "missing": [...]},
-            "screens": {"completeness": 0.X, "accuracy": 0.X, "confidence": 0.X, "missing": [...]},
-            "overall_confidence": 0.X,
-            "needs_manual_review": [...]
-        }
-    """
-    
-    # Prepare summaries for validation
-    entities = parsed_data.get('power_platform_mapping', {}).get('dataverse_tables', [])
-    processes = parsed_data.get('business_processes', [])
-    screens = parsed_data.get('power_platform_mapping', {}).get('power_apps_screens', [])
+def _format_extraction_summary(parsed_data: Dict[str, Any]) -> str:
+    """Summarize extracted entities, processes and screens for validation prompts"""
+    mapping = parsed_data.get('power_platform_mapping') or {}
+    entities = mapping.get('dataverse_tables', [])
+    processes = parsed_data.get('business_processes') or []
+    screens = mapping.get('power_apps_screens', [])
     
     entities_summary = "\n".join([
         f"- {e['legacy_entity']}: {len(e.get('columns', []))} columns (confidence: {e.get('confidence', 0):.0%})"
@@ -327,15 +598,7 @@ def validate_and_score_extraction(
         for s in screens[:10]
     ])
     
-    # Sample code for cross-validation (limit to 2000 chars)
-    code_samples = "\n---\n".join([
-        snippet[:400] + "..." if len(snippet) > 400 else snippet
-        for snippet in sample_code_snippets[:5]
-    ])
-    
-    validation_prompt = f"""You are validating data extraction accuracy from .NET legacy code.
-
-EXTRACTED DATA SUMMARY:
+    return f"""EXTRACTED DATA SUMMARY:
 
 Entities ({len(entities)} total):
 {entities_summary}
@@ -344,302 +607,212 @@ Business Processes ({len(processes)} total):
 {processes_summary}
 
 Screens ({len(screens)} total):
-{screens_summary}
-
-SAMPLE CODE TO VALIDATE AGAINST:
-{code_samples}
-
-TASK: Assess extraction quality for each category:
-
-1. **Completeness**: Did we capture most items visible in code? (0.0-1.0 score)
-2. **Accuracy**: Are extracted items correctly identified? (0.0-1.0 score)
-3. **Confidence**: Overall confidence in this category (0.0-1.0 score)
-4. **Missing**: List any obvious items we missed (array of strings)
-
-Return ONLY valid JSON:
-{{
-    "entities": {{
-        "completeness": 0.85,
-        "accuracy": 0.90,
-        "confidence": 0.88,
-        "missing": ["PossibleTable1", "PossibleTable2"]
-    }},
-    "processes": {{
-        "completeness": 0.75,
-        "accuracy": 0.80,
-        "confidence": 0.78,
-        "missing": ["ApprovalWorkflow"]
-    }},
-    "screens": {{
-        "completeness": 0.80,
-        "accuracy": 0.85,
-        "confidence": 0.82,
-        "missing": []
-    }},
-    "overall_confidence": 0.83,
-    "needs_manual_review": [
-        "Entity 'CustomerAddress' has low confidence (45%)",
-        "Process 'Invoice Processing' missing workflow details"
-    ]
-}}
-
-Be realistic - if code samples don't show certain items, don't penalize. Focus on what's visible.
-"""
-    
-    messages = [
-        {"role": "system", "content": "You are a code extraction validation expert. Be precise and realistic with scores."},
-        {"role": "user", "content": validation_prompt}
-    ]
-    
-    try:
-        response = _chat(messages, temperature=0.0)
-        
-        # Parse JSON response
-        # Try direct parse
-        try:
-            validation_results = json.loads(response)
-        except json.JSONDecodeError:
-            # Try extracting JSON from markdown code blocks
-            json_match = re.search(r'```(?:json)?\s*(.*?)\s*```', response, re.DOTALL)
-            if json_match:
-                validation_results = json.loads(json_match.group(1))
-            else:
-                # Last resort: extract just the JSON object
-                json_match = re.search(r'\{.*\}', response, re.DOTALL)
-                if json_match:
-                    validation_results = json.loads(json_match.group(0))
-                else:
-                    raise ValueError("Could not extract JSON from response")
-        
-        # Ensure all required keys exist with defaults
-        default_category = {"completeness": 0.5, "accuracy": 0.5, "confidence": 0.5, "missing": []}
-        
-        validation_results.setdefault("entities", default_category.copy())
-        validation_results.setdefault("processes", default_category.copy())
-        validation_results.setdefault("screens", default_category.copy())
-        validation_results.setdefault("overall_confidence", 0.5)
-        validation_results.setdefault("needs_manual_review", ["Validation incomplete - review manually"])
-        
-        return validation_results
-        
-    except Exception as e:
-        print(f"⚠️  Validation failed: {str(e)}")
-        # Return safe defaults if validation fails
-        return {
-            "entities": {"completeness": 0.6, "accuracy": 0.6, "confidence": 0.6, "missing": []},
-            "processes": {"completeness": 0.6, "accuracy": 0.6, "confidence": 0.6, "missing": []},
-            "screens": {"completeness": 0.6, "accuracy": 0.6, "confidence": 0.6, "missing": []},
-            "overall_confidence": 0.6,
-            "needs_manual_review": [f"Validation error: {str(e)}", "Manual review recommended"],
-            "validation_error": str(e)
-        }
+{screens_summary}"""
 
 
 # ============================================================
-# ✅ NEW: SEMANTIC BUSINESS RULES EXTRACTION
+# ✅ NEW: RULE / API CANDIDATE CODE
 # ============================================================
 
-def extract_business_rules_from_code(
-    code_snippets: List[str],
-    nodes: List[Dict[str, Any]]
-) -> List[Dict[str, Any]]:
-    """
-    Extract implicit business rules from conditional logic in code.
-    Captures rules buried in if/else statements that aren't in attributes.
-    
-    Args:
-        code_snippets: List of code strings containing business logic
-        nodes: Parsed code nodes for context
-        
-    Returns:
-        List of business rules with implementation guidance
-    """
-    
-    # Filter code snippets that likely contain business rules
-    rule_candidates = []
-    for snippet in code_snippets:
-        # Look for conditional statements
-        if any(keyword in snippet.lower() for keyword in ['if (', 'if(', 'else if', 'switch', 'case ', '? ', '&&', '||']):
-            rule_candidates.append(snippet[:1500])  # Limit size
+def _rule_candidates(code_snippets: List[str]) -> List[str]:
+    """Snippets with conditional logic, or [] when there is too little to be worth an LLM call"""
+    rule_candidates = [
+        snippet for snippet in code_snippets
+        if any(keyword in snippet.lower() for keyword in ['if (', 'if(', 'else if', 'switch', 'case ', '? ', '&&', '||'])
+    ]
     
-    if not rule_candidates:
+    # A single snippet or too few characters of conditional code: not worth asking for rules
+    if rule_candidates and (
+        len(rule_candidates) < 2
+        or sum(len(c) for c in rule_candidates) < MIN_RULE_CANDIDATE_CHARS
+    ):
+        logger.info("Skipping business rules extraction: insufficient candidate code")
         return []
-    
-    # Take top 10 most promising snippets
-    code_sample = "\n\n---CODE SAMPLE---\n\n".join(rule_candidates[:10])
-    
-    prompt = f"""Extract ALL business rules from this code. Focus on:
-- Conditional logic (if/else, switch)
-- Validation rules
-- Authorization checks
-- Approval thresholds
-- Status transitions
-- Calculations and formulas
+    return rule_candidates
 
-CODE SAMPLES:
-{code_sample}
 
-For EACH business rule found, return:
-{{
-    "rule_id": "BR-001",
-    "rule_description": "Orders over $5,000 require Director approval",
-    "condition_logic": "order.Amount > 5000 AND user.Role != 'Director'",
-    "action": "Return Unauthorized or route to approval",
-    "field_involved": ["Order.Amount", "User.Role"],
-    "dataverse_implementation": "Business Rule: If Amount > 5000, set ApprovalRequired = Yes",
-    "power_automate_condition": "If Order Amount is greater than 5000, then start approval flow",
-    "priority": "HIGH|MEDIUM|LOW",
-    "source": "OrderController.ApproveOrder method"
-}}
-
-Return valid JSON array of rules. Extract EVERY rule you find, even simple ones.
-CRITICAL: Return ONLY the JSON array, no markdown formatting.
-"""
-    
-    messages = [
-        {"role": "system", "content": "You are an expert at extracting business rules from code. Be thorough - extract every rule you find."},
-        {"role": "user", "content": prompt}
+def _http_candidates(code_snippets: List[str]) -> List[str]:
+    """Snippets mentioning HTTP APIs, or [] when none of them makes an outbound call"""
+    http_candidates = [
+        snippet for snippet in code_snippets
+        if any(keyword in snippet for keyword in ['HttpClient', 'RestSharp', 'HttpPost', 'HttpGet', 'WebClient', 'fetch(', 'axios'])
     ]
     
-    try:
-        response = _chat(messages, temperature=0.1)
-        
-        # Try direct parse
-        try:
-            rules = json.loads(response)
-        except json.JSONDecodeError:
-            # Try extracting JSON array from markdown
-            json_match = re.search(r'```(?:json)?\s*(\[.*?\])\s*```', response, re.DOTALL)
-            if json_match:
-                rules = json.loads(json_match.group(1))
-            else:
-                # Try finding array directly
-                json_match = re.search(r'\[.*\]', response, re.DOTALL)
-                if json_match:
-                    rules = json.loads(json_match.group(0))
-                else:
-                    print("⚠️  Could not parse business rules JSON")
-                    return []
-        
-        # Ensure rules is a list
-        if not isinstance(rules, list):
-            rules = [rules] if isinstance(rules, dict) else []
-        
-        print(f"✅ Extracted {len(rules)} business rules from code")
-        return rules
-        
-    except Exception as e:
-        print(f"⚠️  Business rules extraction failed: {str(e)}")
+    # Attribute matches alone ([HttpGet] on a controller action) are not outbound calls
+    if http_candidates and not any(call in snippet for snippet in http_candidates for call in OUTBOUND_HTTP_CALLS):
+        logger.info("Skipping API integration extraction: no outbound HTTP calls found")
         return []
+    return http_candidates
 
 
 # ============================================================
-# ✅ NEW: API INTEGRATION CONTRACT EXTRACTION
+# ✅ NEW: COMBINED EXTRACTION (ONE STRUCTURED-OUTPUT CALL)
 # ============================================================
+# Strict JSON schemas cannot express free-form objects, so schemas and
+# error handling come back as name/value lists and are converted to the
+# dict shapes used by generate_brd.
+
+class ExtractionScore(BaseModel):
+    completeness: float
+    accuracy: float
+    confidence: float
+    missing: List[str]
+
+
+class ExtractionValidation(BaseModel):
+    entities: ExtractionScore
+    processes: ExtractionScore
+    screens: ExtractionScore
+    overall_confidence: float
+    needs_manual_review: List[str]
+
+
+class BusinessRule(BaseModel):
+    rule_id: str
+    rule_description: str
+    condition_logic: str
+    action: str
+    field_involved: List[str]
+    dataverse_implementation: str
+    power_automate_condition: str
+    priority: str
+    source: str
+
+
+class SchemaField(BaseModel):
+    name: str
+    type: str
+
+
+class StatusHandling(BaseModel):
+    status_code: str
+    handling: str
+
+
+class ApiAuthentication(BaseModel):
+    type: str
+    token_source: str
+    details: str
 
-def extract_api_integration_contracts(
+
+class PowerAutomateConnector(BaseModel):
+    connector_type: str
+    authentication_config: str
+    error_handling_steps: str
+
+
+class ApiIntegration(BaseModel):
+    integration_name: str
+    endpoint: str
+    method: str
+    authentication: ApiAuthentication
+    request_schema: List[SchemaField]
+    response_schema: List[SchemaField]
+    error_handling: List[StatusHandling]
+    retry_logic: str
+    timeout: str
+    power_automate_connector: PowerAutomateConnector
+    source_file: str
+
+
+class BrdExtraction(BaseModel):
+    validation: ExtractionValidation
+    business_rules: List[BusinessRule]
+    integrations: List[ApiIntegration]
+
+
+def _integration_to_dict(integration: ApiIntegration) -> Dict[str, Any]:
+    """Convert a parsed integration back to the dict shape used by generate_brd"""
+    data = integration.model_dump()
+    data["request_schema"] = {f.name: f.type for f in integration.request_schema}
+    data["response_schema"] = {f.name: f.type for f in integration.response_schema}
+    data["error_handling"] = {h.status_code: h.handling for h in integration.error_handling}
+    return data
+
+
+def extract_brd_insights(
+    parsed_data: Dict[str, Any],
     code_snippets: List[str],
     nodes: List[Dict[str, Any]]
-) -> List[Dict[str, Any]]:
+) -> Dict[str, Any]:
     """
-    Reverse engineer API contracts from HttpClient usage in code.
-    Extracts endpoints, methods, auth, request/response schemas, error handling.
+    Run validation, business rules and API contract extraction in one call.
+    The code samples are sent once and the response is schema-constrained JSON
+    (cached like _chat). Falls back to neutral scores and no rules or APIs if
+    the call fails.
     
-    Args:
-        code_snippets: Code containing HTTP calls
-        nodes: Parsed nodes for context
-        
     Returns:
-        List of API integration contracts
+        {"validation": {...}, "business_rules": [...], "integrations": [...]}
     """
+    code_sample = _join_code_samples(code_snippets[:10], 2000, "\n\n---CODE SAMPLE---\n\n")
+    
+    # Don't have the model hunt for rules or APIs the candidate scan ruled out
+    rules_task = (
+        "EVERY business rule in the code - conditional logic,\n"
+        "   validation rules, authorization checks, approval thresholds, status transitions,\n"
+        "   calculations. Number them BR-001, BR-002, ... and set priority to HIGH, MEDIUM or LOW."
+        if _rule_candidates(code_snippets) else
+        "Return an empty list - the code has too little conditional logic."
+    )
+    integrations_task = (
+        "EVERY distinct HTTP API integration (HttpClient, RestSharp,\n"
+        "   WebClient, fetch, axios) with endpoint, method, authentication, request/response\n"
+        "   fields, error handling per status code, retry logic, timeout and the equivalent\n"
+        "   Power Automate connector setup. Return an empty list if there are none."
+        if _http_candidates(code_snippets) else
+        "Return an empty list - the code makes no outbound HTTP calls."
+    )
     
-    # Filter snippets with HTTP calls
-    http_candidates = []
-    for snippet in code_snippets:
-        if any(keyword in snippet for keyword in ['HttpClient', 'RestSharp', 'HttpPost', 'HttpGet', 'WebClient', 'fetch(', 'axios']):
-            http_candidates.append(snippet[:2000])
-    
-    if not http_candidates:
-        return []
-    
-    code_sample = "\n\n---HTTP CALL SAMPLE---\n\n".join(http_candidates[:8])
-    
-    prompt = f"""Analyze these HTTP API calls and extract integration contracts.
+    prompt = f"""Analyze this .NET legacy code and the data already extracted from it.
+
+{_format_extraction_summary(parsed_data)}
 
-CODE WITH API CALLS:
+CODE SAMPLES:
 {code_sample}
 
-For EACH distinct API integration, extract:
-{{
-    "integration_name": "ERP Order Sync",
-    "endpoint": "https://api.erp.com/orders",
-    "method": "POST",
-    "authentication": {{
-        "type": "OAuth 2.0 / Bearer Token / API Key / Basic",
-        "token_source": "Configuration / Azure KeyVault / Hardcoded",
-        "details": "client_credentials flow"
-    }},
-    "request_schema": {{
-        "orderNumber": "string",
-        "totalAmount": "decimal",
-        "items": "array"
-    }},
-    "response_schema": {{
-        "orderId": "string",
-        "status": "string"
-    }},
-    "error_handling": {{
-        "400": "Invalid request - log error and notify admin",
-        "401": "Authentication failed - refresh token and retry",
-        "500": "Server error - retry 3 times with exponential backoff"
-    }},
-    "retry_logic": "3 attempts with 1s, 2s, 4s delays",
-    "timeout": "30 seconds",
-    "power_automate_connector": {{
-        "connector_type": "HTTP / Custom Connector",
-        "authentication_config": "OAuth 2.0 with client credentials",
-        "error_handling_steps": "Scope + Configure run after + Send notification"
-    }},
-    "source_file": "OrderService.cs"
-}}
-
-Return valid JSON array. Extract EVERY API call you find.
-CRITICAL: Return ONLY the JSON array, no markdown.
+Return three things:
+
+1. **validation**: For entities, processes and screens, score completeness, accuracy
+   and confidence (0.0-1.0) of the extracted data against the code, list obvious
+   missed items, give an overall_confidence and the items needing manual review.
+   Be realistic - if code samples don't show certain items, don't penalize.
+
+2. **business_rules**: {rules_task}
+
+3. **integrations**: {integrations_task}
 """
     
     messages = [
-        {"role": "system", "content": "You are an expert at reverse-engineering API contracts from code. Extract complete integration specs."},
+        {"role": "system", "content": "You are an expert at extracting business rules and API contracts from code and validating extraction quality. Be thorough and realistic."},
         {"role": "user", "content": prompt}
     ]
     
     try:
-        response = _chat(messages, temperature=0.1)
-        
-        # Try direct parse
-        try:
-            integrations = json.loads(response)
-        except json.JSONDecodeError:
-            # Try extracting from markdown
-            json_match = re.search(r'```(?:json)?\s*(\[.*?\])\s*```', response, re.DOTALL)
-            if json_match:
-                integrations = json.loads(json_match.group(1))
-            else:
-                json_match = re.search(r'\[.*\]', response, re.DOTALL)
-                if json_match:
-                    integrations = json.loads(json_match.group(0))
-                else:
-                    print("⚠️  Could not parse integrations JSON")
-                    return []
-        
-        if not isinstance(integrations, list):
-            integrations = [integrations] if isinstance(integrations, dict) else []
-        
-        print(f"✅ Extracted {len(integrations)} API integrations")
-        return integrations
+        extraction = _chat_parsed(messages, BrdExtraction, temperature=0.1)
+        result = {
+            "validation": extraction.validation.model_dump(),
+            "business_rules": [rule.model_dump() for rule in extraction.business_rules],
+            "integrations": [_integration_to_dict(i) for i in extraction.integrations],
+        }
+        logger.info("✅ Extracted %d business rules and %d API integrations",
+                    len(result["business_rules"]), len(result["integrations"]))
+        return result
         
     except Exception as e:
-        print(f"⚠️  Integration extraction failed: {str(e)}")
-        return []
+        logger.warning("⚠️  Combined extraction failed: %s", e)
+        neutral = {"completeness": 0.6, "accuracy": 0.6, "confidence": 0.6, "missing": []}
+        return {
+            "validation": {
+                "entities": dict(neutral),
+                "processes": dict(neutral),
+                "screens": dict(neutral),
+                "overall_confidence": 0.6,
+                "needs_manual_review": [f"Validation error: {str(e)}", "Manual review recommended"],
+                "validation_error": str(e),
+            },
+            "business_rules": [],
+            "integrations": [],
+        }
 
 
 # ============================================================
@@ -651,47 +824,85 @@ def generate_brd(retrieved: List[Dict[str, Any]],
                  metrics: Dict[str, Any] = None,
                  business_processes: List[Dict[str, Any]] = None,
                  power_platform_mapping: Dict[str, Any] = None) -> str:
-    """Generate comprehensive BRD with metrics and Power Platform focus"""
+    """
+    Generate comprehensive BRD with metrics and Power Platform focus.
+    Synchronous entry point; async callers should await generate_brd_async.
+    """
+    coro = generate_brd_async(retrieved, nodes, metrics, business_processes, power_platform_mapping)
     try:
-        graph_summary = summarize_graph_enhanced(nodes)
-        context = _make_context_snippets(retrieved, max_chars=15000)
-        
-        # Format additional context
-        metrics_summary = format_metrics_summary(metrics or {})
-        processes_summary = format_business_processes(business_processes or [])
-        mapping_summary = format_power_platform_mapping(power_platform_mapping or {})
-        
-        messages = [
-            {"role": "system", "content": BRD_SYSTEM_PROMPT},
-            {"role": "user", "content": f"""
-            GRAPH:
-            {graph_summary}
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    # Called from inside a running event loop, where asyncio.run raises:
+    # run the coroutine on its own loop in a worker thread instead
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+def _format_analysis(nodes: List[Dict[str, Any]],
+                     metrics: Dict[str, Any] = None,
+                     business_processes: List[Dict[str, Any]] = None,
+                     power_platform_mapping: Dict[str, Any] = None) -> Tuple[str, str, str, str]:
+    """Graph, metrics, business process and Power Platform mapping summaries for a prompt"""
+    return (
+        summarize_graph_enhanced(nodes),
+        format_metrics_summary(metrics or {}),
+        format_business_processes(business_processes or []),
+        format_power_platform_mapping(power_platform_mapping or {}),
+    )
 
-            {metrics_summary}
 
-            {processes_summary}
+def _prepare_brd_inputs(retrieved: List[Dict[str, Any]],
+                        nodes: List[Dict[str, Any]],
+                        metrics: Dict[str, Any] = None,
+                        business_processes: List[Dict[str, Any]] = None,
+                        power_platform_mapping: Dict[str, Any] = None) -> Dict[str, Any]:
+    """Build the BRD prompt and the extractor code samples"""
+    graph_summary, metrics_summary, processes_summary, mapping_summary = _format_analysis(
+        nodes, metrics, business_processes, power_platform_mapping
+    )
+    context = _make_context_snippets(retrieved, max_tokens=CONTEXT_TOKEN_BUDGETS["brd"])
+    
+    messages = [
+        {"role": "system", "content": BRD_SYSTEM_PROMPT},
+        {"role": "user", "content": _user_msg(f"""
+GRAPH:
+{graph_summary}
 
-            {mapping_summary}
+{metrics_summary}
 
-            CONTEXT SNIPPETS:
-            {context}
-            """}
-        ]
-    except Exception as e:
-        print(f"⚠️  Error preparing BRD context: {str(e.with_traceback(None))}")
-        return "Error generating BRD."
-    # Generate BRD content
-    brd_content = _chat(messages, temperature=0.1)
-    # return brd_content
+{processes_summary}
+
+{mapping_summary}
+
+CONTEXT SNIPPETS:
+{context}
+""")}
+    ]
+    # Up to 10 distinct snippets (overlapping chunks often repeat), pre-trimmed
+    # so the extractors and their caches never handle oversized text
+    distinct_code = dict.fromkeys(r["text"] for r in retrieved[:20] if r.get("text"))
+    sample_code = [text[:MAX_SAMPLE_SNIPPET_CHARS] for text in list(distinct_code)[:10]]
+    
+    return {
+        "messages": messages,
+        "sample_code": sample_code,
+    }
+
+
+# Marker shown next to a rule or prompt of each priority (anything else renders as LOW)
+PRIORITY_EMOJI = {"HIGH": "🔴", "MEDIUM": "🟡", "LOW": "🟢"}
+
+
+def _render_extraction_sections(extraction: Dict[str, Any]) -> str:
+    """Markdown appended to the BRD: business rules, API contracts and the validation report"""
     try:
-        # ✅ NEW: Extract business rules from code
-        print("Extracting business rules from code...")
-        sample_code = [r["text"] for r in retrieved[:10]]  # Get more samples for rules
-        business_rules = extract_business_rules_from_code(sample_code, nodes)
+        parts = []
+        business_rules = extraction["business_rules"]
         
         # Add business rules section to BRD
         if business_rules:
-            rules_section = f"""
+            parts.append(f"""
 
     ---
 
@@ -699,11 +910,11 @@ def generate_brd(retrieved: List[Dict[str, Any]],
 
     **Total Rules Found:** {len(business_rules)}
 
-    """
+    """)
             for rule in business_rules:
-                priority_emoji = "🔴" if rule.get('priority') == 'HIGH' else "🟡" if rule.get('priority') == 'MEDIUM' else "🟢"
+                priority_emoji = PRIORITY_EMOJI.get(rule.get('priority'), "🟢")
                 
-                rules_section += f"""### {rule.get('rule_id', 'BR-???')}: {rule.get('rule_description', 'Unknown Rule')} {priority_emoji}
+                parts.append(f"""### {rule.get('rule_id', 'BR-???')}: {rule.get('rule_description', 'Unknown Rule')} {priority_emoji}
 
     **Condition:** `{rule.get('condition_logic', 'N/A')}`  
     **Action:** {rule.get('action', 'N/A')}  
@@ -717,16 +928,13 @@ def generate_brd(retrieved: List[Dict[str, Any]],
 
     ---
 
-    """
-            
-            brd_content += rules_section
+    """)
         
-        # ✅ NEW: Extract API integration contracts
-        print("Extracting API integration contracts...")
-        api_integrations = extract_api_integration_contracts(sample_code, nodes)
+        # ✅ NEW: API integration contracts
+        api_integrations = extraction["integrations"]
         
         if api_integrations:
-            integrations_section = f"""
+            parts.append(f"""
 
     ---
 
@@ -734,61 +942,58 @@ def generate_brd(retrieved: List[Dict[str, Any]],
 
     **Total Integrations Found:** {len(api_integrations)}
 
-    """
+    """)
             for integration in api_integrations:
-                integrations_section += f"""### {integration.get('integration_name', 'Unknown Integration')}
+                authentication = integration.get('authentication', {})
+                connector = integration.get('power_automate_connector', {})
+                
+                parts.append(f"""### {integration.get('integration_name', 'Unknown Integration')}
 
     **Endpoint:** `{integration.get('method', 'GET')} {integration.get('endpoint', 'N/A')}`  
-    **Authentication:** {integration.get('authentication', {}).get('type', 'Unknown')}  
+    **Authentication:** {authentication.get('type', 'Unknown')}  
     **Source:** {integration.get('source_file', 'Unknown')}
 
     #### Request Schema
     ```json
-    {json.dumps(integration.get('request_schema', {}), indent=2)}
+    {_dumps_indented(integration.get('request_schema', {}))}
     ```
 
     #### Response Schema
     ```json
-    {json.dumps(integration.get('response_schema', {}), indent=2)}
+    {_dumps_indented(integration.get('response_schema', {}))}
     ```
 
     #### Error Handling
-    """
+    """)
                 
                 error_handling = integration.get('error_handling', {})
                 if error_handling:
-                    for status_code, handling in error_handling.items():
-                        integrations_section += f"- **{status_code}:** {handling}\n"
+                    parts.append("".join(f"- **{status_code}:** {handling}\n"
+                                         for status_code, handling in error_handling.items()))
                 else:
-                    integrations_section += "- No specific error handling detected\n"
+                    parts.append("- No specific error handling detected\n")
                 
-                integrations_section += f"""
+                parts.append(f"""
     **Retry Logic:** {integration.get('retry_logic', 'None detected')}  
     **Timeout:** {integration.get('timeout', 'Not specified')}
 
     #### Power Automate Implementation
-    - **Connector Type:** {integration.get('power_automate_connector', {}).get('connector_type', 'HTTP')}
-    - **Authentication:** {integration.get('power_automate_connector', {}).get('authentication_config', 'Configure manually')}
-    - **Error Handling:** {integration.get('power_automate_connector', {}).get('error_handling_steps', 'Add error scopes')}
+    - **Connector Type:** {connector.get('connector_type', 'HTTP')}
+    - **Authentication:** {connector.get('authentication_config', 'Configure manually')}
+    - **Error Handling:** {connector.get('error_handling_steps', 'Add error scopes')}
 
     ---
 
-    """
-            
-            brd_content += integrations_section
+    """)
         
         # ✅ NEW: Add validation report
-        print("Running extraction validation...")
-        
-        validation = validate_and_score_extraction(
-            {"power_platform_mapping": power_platform_mapping,
-                "business_processes": business_processes
-            },
-            sample_code
-        )
+        validation = extraction["validation"]
+        entities = validation.get('entities', {})
+        processes = validation.get('processes', {})
+        screens = validation.get('screens', {})
         
         # Append validation section to BRD
-        validation_section = f"""
+        parts.append(f"""
 
     ---
 
@@ -798,43 +1003,102 @@ def generate_brd(retrieved: List[Dict[str, Any]],
 
     | Category | Completeness | Accuracy | Confidence | Status |
     |----------|--------------|----------|------------|--------|
-    | **Entities** | {validation.get('entities', {}).get('completeness', 0):.0%} | {validation.get('entities', {}).get('accuracy', 0):.0%} | {validation.get('entities', {}).get('confidence', 0):.0%} | {'✅ Good' if validation.get('entities', {}).get('confidence', 0) >= 0.7 else '⚠️ Review'} |
-    | **Processes** | {validation.get('processes', {}).get('completeness', 0):.0%} | {validation.get('processes', {}).get('accuracy', 0):.0%} | {validation.get('processes', {}).get('confidence', 0):.0%} | {'✅ Good' if validation.get('processes', {}).get('confidence', 0) >= 0.7 else '⚠️ Review'} |
-    | **Screens** | {validation.get('screens', {}).get('completeness', 0):.0%} | {validation.get('screens', {}).get('accuracy', 0):.0%} | {validation.get('screens', {}).get('confidence', 0):.0%} | {'✅ Good' if validation.get('screens', {}).get('confidence', 0) >= 0.7 else '⚠️ Review'} |
+    | **Entities** | {entities.get('completeness', 0):.0%} | {entities.get('accuracy', 0):.0%} | {entities.get('confidence', 0):.0%} | {'✅ Good' if entities.get('confidence', 0) >= 0.7 else '⚠️ Review'} |
+    | **Processes** | {processes.get('completeness', 0):.0%} | {processes.get('accuracy', 0):.0%} | {processes.get('confidence', 0):.0%} | {'✅ Good' if processes.get('confidence', 0) >= 0.7 else '⚠️ Review'} |
+    | **Screens** | {screens.get('completeness', 0):.0%} | {screens.get('accuracy', 0):.0%} | {screens.get('confidence', 0):.0%} | {'✅ Good' if screens.get('confidence', 0) >= 0.7 else '⚠️ Review'} |
 
     ### ⚠️ Items Requiring Manual Review
 
-    """
+    """)
         
         needs_review = validation.get('needs_manual_review', [])
         if needs_review:
-            for item in needs_review:
-                validation_section += f"- {item}\n"
+            parts.append("".join(f"- {item}\n" for item in needs_review))
         else:
-            validation_section += "- No items flagged for review\n"
+            parts.append("- No items flagged for review\n")
         
-        validation_section += "\n### 🔎 Potentially Missed Items\n\n"
+        parts.append("\n### 🔎 Potentially Missed Items\n\n")
         
         any_missing = False
         for category in ['entities', 'processes', 'screens']:
             missing = validation.get(category, {}).get('missing', [])
             if missing:
-                validation_section += f"**{category.title()}:**\n"
-                for item in missing:
-                    validation_section += f"- {item}\n"
+                parts.append(f"**{category.title()}:**\n")
+                parts.append("".join(f"- {item}\n" for item in missing))
                 any_missing = True
         
         if not any_missing:
-            validation_section += "*No missing items detected in validation sample*\n"
+            parts.append("*No missing items detected in validation sample*\n")
         
-        validation_section += "\n**Note:** This validation is based on a sample of the codebase. " \
-                            "Items flagged for review or with confidence < 70% should be manually verified against the full source code.\n"
-        return brd_content + validation_section
+        parts.append("\n**Note:** This validation is based on a sample of the codebase. "
+                     "Items flagged for review or with confidence < 70% should be manually verified against the full source code.\n")
+        return ''.join(parts)
+    except Exception as e:
+        logger.warning("⚠️  Error during validation integration: %r", e)
+        return "\n\n---\n\n## ⚠️ Extraction Validation Error\nAn error occurred during extraction validation. Please review the extracted data manually.\n"
+
+
+async def generate_brd_async(retrieved: List[Dict[str, Any]], 
+                             nodes: List[Dict[str, Any]], 
+                             metrics: Dict[str, Any] = None,
+                             business_processes: List[Dict[str, Any]] = None,
+                             power_platform_mapping: Dict[str, Any] = None) -> str:
+    """
+    Generate the BRD. The main BRD call and the rules/API/validation
+    extraction are independent, so they run concurrently.
+    """
+    try:
+        inputs = _prepare_brd_inputs(retrieved, nodes, metrics, business_processes, power_platform_mapping)
     except Exception as e:
-        print(f"⚠️  Error during validation integration: {str(e.with_traceback(None))}")
-        validation_section = "\n\n---\n\n## ⚠️ Extraction Validation Error\nAn error occurred during extraction validation. Please review the extracted data manually.\n"
+        logger.warning("⚠️  Error preparing BRD context: %r", e)
+        return "Error generating BRD."
     
+    # Generate BRD content and, concurrently, extract business rules,
+    # API contracts and validation in one call
+    logger.info("Generating BRD and extracting business rules, API contracts and validation...")
+    brd_content, extraction = await asyncio.gather(
+        asyncio.to_thread(_chat, inputs["messages"], temperature=0.1),
+        asyncio.to_thread(
+            extract_brd_insights,
+            {"power_platform_mapping": power_platform_mapping,
+                "business_processes": business_processes
+            },
+            inputs["sample_code"],
+            nodes
+        )
+    )
+    return brd_content + _render_extraction_sections(extraction)
+
 
+def generate_brd_stream(retrieved: List[Dict[str, Any]], 
+                        nodes: List[Dict[str, Any]], 
+                        metrics: Dict[str, Any] = None,
+                        business_processes: List[Dict[str, Any]] = None,
+                        power_platform_mapping: Dict[str, Any] = None):
+    """
+    Streaming generate_brd: yield the BRD text as the model writes it, then the
+    extracted sections. The extraction starts first and runs in the background,
+    so it is usually finished by the time the BRD stream closes.
+    """
+    try:
+        inputs = _prepare_brd_inputs(retrieved, nodes, metrics, business_processes, power_platform_mapping)
+    except Exception as e:
+        logger.warning("⚠️  Error preparing BRD context: %r", e)
+        yield "Error generating BRD."
+        return
+    
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        extraction = executor.submit(
+            extract_brd_insights,
+            {"power_platform_mapping": power_platform_mapping,
+                "business_processes": business_processes
+            },
+            inputs["sample_code"],
+            nodes
+        )
+        yield from _chat_stream(inputs["messages"], temperature=0.1)
+        yield _render_extraction_sections(extraction.result())
+    
 
 # ============================================================
 # OTHER GENERATION FUNCTIONS
@@ -848,13 +1112,13 @@ def generate_complexity_analysis(metrics: Dict[str, Any], nodes: List[Dict[str,
     
     messages = [
         {"role": "system", "content": COMPLEXITY_ANALYSIS_PROMPT},
-        {"role": "user", "content": f"""
+        {"role": "user", "content": _user_msg(f"""
 {metrics_summary}
 
 {graph_summary}
 
 Provide detailed analysis of code complexity and migration recommendations.
-"""}
+""")}
     ]
     
     return _chat(messages, temperature=0.0)
@@ -869,13 +1133,13 @@ def generate_business_process_flows(business_processes: List[Dict[str, Any]],
     
     messages = [
         {"role": "system", "content": BUSINESS_PROCESS_FLOW_PROMPT},
-        {"role": "user", "content": f"""
+        {"role": "user", "content": _user_msg(f"""
 {processes_summary}
 
 {graph_summary}
 
 Generate detailed business process flow documentation for Power Platform migration.
-"""}
+""")}
     ]
     
     return _chat(messages, temperature=0.0)
@@ -892,7 +1156,7 @@ def generate_power_platform_detailed_mapping(power_platform_mapping: Dict[str, A
     
     messages = [
         {"role": "system", "content": POWER_PLATFORM_MAPPING_PROMPT},
-        {"role": "user", "content": f"""
+        {"role": "user", "content": _user_msg(f"""
 {mapping_summary}
 
 {processes_summary}
@@ -900,12 +1164,23 @@ def generate_power_platform_detailed_mapping(power_platform_mapping: Dict[str, A
 {graph_summary}
 
 Generate comprehensive Power Platform component mapping and migration strategy.
-"""}
+""")}
     ]
     
     return _chat(messages, temperature=0.0)
 
 
+# Node kinds whose authorization attributes name user roles
+_ROLE_NODE_KINDS = frozenset({"mvc_controller", "mvc_action"})
+
+
+def _string_roles(roles) -> List[str]:
+    """The non-empty string entries of a roles list (anything else yields nothing)"""
+    if not isinstance(roles, list):
+        return []
+    return [role for role in roles if role and isinstance(role, str)]
+
+
 def generate_user_stories(business_processes: List[Dict[str, Any]], 
                          nodes: List[Dict[str, Any]],
                          power_platform_mapping: Dict[str, Any], *args, **kwargs) -> str:
@@ -915,30 +1190,30 @@ def generate_user_stories(business_processes: List[Dict[str, Any]],
     mapping_summary = format_power_platform_mapping(power_platform_mapping or {})
     graph_summary = summarize_graph_enhanced(nodes or [])
     
-    # Extract personas from nodes (from authorization attributes)
-    personas = set()
-    for node in nodes:
-        if node.get("kind") in ["mvc_controller", "mvc_action"]:
-            roles = node.get("props", {}).get("roles", [])
-            if roles and isinstance(roles, list):
-                for role in roles:
-                    if role and isinstance(role, str):
-                        personas.update(r.strip() for r in role.split(',') if r.strip())
+    # Extract personas from nodes (from authorization attributes, comma-separated)
+    personas = {
+        persona.strip()
+        for node in nodes or []
+        if node.get("kind") in _ROLE_NODE_KINDS
+        for role in _string_roles(node.get("props", {}).get("roles"))
+        for persona in role.split(',')
+        if persona.strip()
+    }
     
     # Also extract from business processes
-    for process in business_processes or []:
-        for step in process.get('workflow_steps', []):
-            roles = step.get('roles', [])
-            if roles and isinstance(roles, list):
-                for role in roles:
-                    if role and isinstance(role, str):
-                        personas.add(role.strip())
+    personas.update(
+        role.strip()
+        for process in business_processes or []
+        for step in process.get('workflow_steps', [])
+        for role in _string_roles(step.get('roles'))
+        if role.strip()
+    )
 
-    personas_text = f"IDENTIFIED PERSONAS: {', '.join(personas)}" if personas else "No explicit personas found in authorization attributes."
+    personas_text = f"IDENTIFIED PERSONAS: {', '.join(sorted(personas))}" if personas else "No explicit personas found in authorization attributes."
     
     messages = [
         {"role": "system", "content": USER_STORY_GENERATION_PROMPT},
-        {"role": "user", "content": f"""
+        {"role": "user", "content": _user_msg(f"""
 {personas_text}
 
 {processes_summary}
@@ -948,7 +1223,7 @@ def generate_user_stories(business_processes: List[Dict[str, Any]],
 {graph_summary}
 
 Generate comprehensive user stories for Power Platform development teams.
-"""}
+""")}
     ]
     
     return _chat(messages, temperature=0.1)
@@ -962,7 +1237,7 @@ def answer_question_enhanced(question: str,
     """Enhanced Q&A with metrics and business process context"""
     
     graph_summary = summarize_graph_enhanced(nodes)
-    context = _make_context_snippets(retrieved, max_chars=8000)
+    context = _make_context_snippets(retrieved, max_tokens=2000)
     
     additional_context = ""
     if metrics:
@@ -972,7 +1247,7 @@ def answer_question_enhanced(question: str,
     
     messages = [
         {"role": "system", "content": QNA_SYSTEM_PROMPT},
-        {"role": "user", "content": f"""
+        {"role": "user", "content": _user_msg(f"""
 QUESTION:
 {question}
 
@@ -983,7 +1258,7 @@ GRAPH:
 
 CONTEXT:
 {context}
-"""}
+""")}
     ]
     
     return _chat(messages, temperature=0.0)
@@ -992,148 +1267,132 @@ CONTEXT:
 # ============================================================
 # ASYNC DOCUMENT GENERATORS FOR TAB 6
 # ============================================================
+# All Tab 6 documents share one system prompt and one analysis prefix
+# (graph, metrics, processes, mapping, snippets); only the task directive
+# at the end differs. Azure OpenAI caches identical prompt prefixes, so
+# after the first document the shared prefix is billed at the cached rate.
+
+DOCUMENT_SYSTEM_PROMPT = (
+    "You are a senior business analyst documenting a legacy .NET application "
+    "for migration to Microsoft Power Platform. Use only the analysis and code "
+    "provided, and follow the TASK at the end of the user message."
+)
 
-import asyncio
-from datetime import datetime
 
-async def generate_business_flows(retrieved: List[Dict[str, Any]], 
-                         nodes: List[Dict[str, Any]], 
-                         metrics: Dict[str, Any] = None,
-                         business_processes: List[Dict[str, Any]] = None,
-                         power_platform_mapping: Dict[str, Any] = None) -> str:
-    """Generate comprehensive business process flows documentation"""
-    
-    graph_summary = summarize_graph_enhanced(nodes)
-    context = _make_context_snippets(retrieved, max_chars=15000)
-    
-    # Format additional context
-    metrics_summary = format_metrics_summary(metrics or {})
-    processes_summary = format_business_processes(business_processes or [])
-    mapping_summary = format_power_platform_mapping(power_platform_mapping or {})
-    
-    messages = [
-        {"role": "system", "content": "Generate detailed business process flow documentation for .NET to Power Platform migration. Create a structured document with process flows, decision points, and Power Platform mappings."},
-        {"role": "user", "content": f"""
-        GRAPH:
-        {graph_summary}
+def _build_document_messages(directive: str,
+                             graph_summary: str,
+                             metrics_summary: str,
+                             processes_summary: str,
+                             mapping_summary: str,
+                             context: str) -> List[Dict[str, str]]:
+    """Static analysis prefix first, section-specific directive last"""
+    return [
+        {"role": "system", "content": DOCUMENT_SYSTEM_PROMPT},
+        {"role": "user", "content": _user_msg(f"""
+GRAPH:
+{graph_summary}
 
-        {metrics_summary}
+{metrics_summary}
 
-        {processes_summary}
+{processes_summary}
 
-        {mapping_summary}
+{mapping_summary}
 
-        CONTEXT SNIPPETS:
-        {context}
-        """}
+CONTEXT SNIPPETS:
+{context}
+
+TASK:
+{directive}
+""")}
     ]
-    
-    return _chat(messages, temperature=0.1)
 
 
-async def generate_tables_analysis(retrieved: List[Dict[str, Any]], 
+async def generate_business_flows(retrieved: List[Dict[str, Any]], 
                          nodes: List[Dict[str, Any]], 
                          metrics: Dict[str, Any] = None,
                          business_processes: List[Dict[str, Any]] = None,
-                         power_platform_mapping: Dict[str, Any] = None) -> str:
-    """Generate comprehensive database and Dataverse mapping documentation"""
+                         power_platform_mapping: Dict[str, Any] = None,
+                         formatted: Tuple[str, str, str, str] = None,
+                         context: str = None) -> str:
+    """Generate comprehensive business process flows documentation (formatted / context: prebuilt for these same inputs)"""
     
-    graph_summary = summarize_graph_enhanced(nodes)
-    context = _make_context_snippets(retrieved, max_chars=15000)
+    graph_summary, metrics_summary, processes_summary, mapping_summary = (
+        formatted or _format_analysis(nodes, metrics, business_processes, power_platform_mapping)
+    )
+    context = context or _make_context_snippets(retrieved, max_tokens=CONTEXT_TOKEN_BUDGETS["flows"])
     
-    # Format additional context
-    metrics_summary = format_metrics_summary(metrics or {})
-    processes_summary = format_business_processes(business_processes or [])
-    mapping_summary = format_power_platform_mapping(power_platform_mapping or {})
+    messages = _build_document_messages(
+        "Generate detailed business process flow documentation for .NET to Power Platform migration. Create a structured document with process flows, decision points, and Power Platform mappings.",
+        graph_summary, metrics_summary, processes_summary, mapping_summary, context
+    )
     
-    messages = [
-        {"role": "system", "content": "Generate detailed Dataverse table mapping documentation for .NET to Power Platform migration. Create a structured document with table schemas, relationships, and migration strategies."},
-        {"role": "user", "content": f"""
-        GRAPH:
-        {graph_summary}
-
-        {metrics_summary}
-
-        {processes_summary}
+    return await asyncio.to_thread(_chat, messages, temperature=0.1, model=CHEAP_CHAT_DEPLOY)
 
-        {mapping_summary}
 
-        CONTEXT SNIPPETS:
-        {context}
-        """}
-    ]
+async def generate_tables_analysis(retrieved: List[Dict[str, Any]], 
+                         nodes: List[Dict[str, Any]], 
+                         metrics: Dict[str, Any] = None,
+                         business_processes: List[Dict[str, Any]] = None,
+                         power_platform_mapping: Dict[str, Any] = None,
+                         formatted: Tuple[str, str, str, str] = None,
+                         context: str = None) -> str:
+    """Generate comprehensive database and Dataverse mapping documentation (formatted / context: prebuilt for these same inputs)"""
     
-    return _chat(messages, temperature=0.1)
+    graph_summary, metrics_summary, processes_summary, mapping_summary = (
+        formatted or _format_analysis(nodes, metrics, business_processes, power_platform_mapping)
+    )
+    context = context or _make_context_snippets(retrieved, max_tokens=CONTEXT_TOKEN_BUDGETS["tables"])
+    
+    messages = _build_document_messages(
+        "Generate detailed Dataverse table mapping documentation for .NET to Power Platform migration. Create a structured document with table schemas, relationships, and migration strategies.",
+        graph_summary, metrics_summary, processes_summary, mapping_summary, context
+    )
+    
+    return await asyncio.to_thread(_chat, messages, temperature=0.1, model=CHEAP_CHAT_DEPLOY)
 
 
 async def generate_user_journeys(retrieved: List[Dict[str, Any]], 
                          nodes: List[Dict[str, Any]], 
                          metrics: Dict[str, Any] = None,
                          business_processes: List[Dict[str, Any]] = None,
-                         power_platform_mapping: Dict[str, Any] = None) -> str:
-    """Generate comprehensive user journey documentation"""
+                         power_platform_mapping: Dict[str, Any] = None,
+                         formatted: Tuple[str, str, str, str] = None,
+                         context: str = None) -> str:
+    """Generate comprehensive user journey documentation (formatted / context: prebuilt for these same inputs)"""
     
-    graph_summary = summarize_graph_enhanced(nodes)
-    context = _make_context_snippets(retrieved, max_chars=15000)
+    graph_summary, metrics_summary, processes_summary, mapping_summary = (
+        formatted or _format_analysis(nodes, metrics, business_processes, power_platform_mapping)
+    )
+    context = context or _make_context_snippets(retrieved, max_tokens=CONTEXT_TOKEN_BUDGETS["journeys"])
     
-    # Format additional context
-    metrics_summary = format_metrics_summary(metrics or {})
-    processes_summary = format_business_processes(business_processes or [])
-    mapping_summary = format_power_platform_mapping(power_platform_mapping or {})
+    messages = _build_document_messages(
+        "Generate detailed user journey documentation for .NET to Power Platform migration. Create step-by-step user flows showing how different personas interact with the system.",
+        graph_summary, metrics_summary, processes_summary, mapping_summary, context
+    )
     
-    messages = [
-        {"role": "system", "content": "Generate detailed user journey documentation for .NET to Power Platform migration. Create step-by-step user flows showing how different personas interact with the system."},
-        {"role": "user", "content": f"""
-        GRAPH:
-        {graph_summary}
-
-        {metrics_summary}
-
-        {processes_summary}
-
-        {mapping_summary}
-
-        CONTEXT SNIPPETS:
-        {context}
-        """}
-    ]
-    
-    return _chat(messages, temperature=0.1)
+    return await asyncio.to_thread(_chat, messages, temperature=0.1, model=CHEAP_CHAT_DEPLOY)
 
 
 async def generate_personas(retrieved: List[Dict[str, Any]], 
                          nodes: List[Dict[str, Any]], 
                          metrics: Dict[str, Any] = None,
                          business_processes: List[Dict[str, Any]] = None,
-                         power_platform_mapping: Dict[str, Any] = None) -> str:
-    """Generate persona documentation"""
-    
-    graph_summary = summarize_graph_enhanced(nodes)
-    context = _make_context_snippets(retrieved, max_chars=15000)
+                         power_platform_mapping: Dict[str, Any] = None,
+                         formatted: Tuple[str, str, str, str] = None,
+                         context: str = None) -> str:
+    """Generate persona documentation (formatted / context: prebuilt for these same inputs)"""
     
-    # Format additional context
-    metrics_summary = format_metrics_summary(metrics or {})
-    processes_summary = format_business_processes(business_processes or [])
-    mapping_summary = format_power_platform_mapping(power_platform_mapping or {})
+    graph_summary, metrics_summary, processes_summary, mapping_summary = (
+        formatted or _format_analysis(nodes, metrics, business_processes, power_platform_mapping)
+    )
+    context = context or _make_context_snippets(retrieved, max_tokens=CONTEXT_TOKEN_BUDGETS["personas"])
     
-    messages = [
-        {"role": "system", "content": "Generate persona documentation for .NET to Power Platform migration. Create detailed user personas with roles, responsibilities, goals, and pain points."},
-        {"role": "user", "content": f"""
-        GRAPH:
-        {graph_summary}
-
-        {metrics_summary}
-
-        {processes_summary}
-
-        {mapping_summary}
-
-        CONTEXT SNIPPETS:
-        {context}
-        """}
-    ]
+    messages = _build_document_messages(
+        "Generate persona documentation for .NET to Power Platform migration. Create detailed user personas with roles, responsibilities, goals, and pain points.",
+        graph_summary, metrics_summary, processes_summary, mapping_summary, context
+    )
     
-    return _chat(messages, temperature=0.1)
+    return await asyncio.to_thread(_chat, messages, temperature=0.1, model=CHEAP_CHAT_DEPLOY)
 
 
 async def generate_user_storie(analysis_data: Dict[str, Any]) -> str:
@@ -1143,7 +1402,7 @@ async def generate_user_storie(analysis_data: Dict[str, Any]) -> str:
     business_processes = analysis_data.get('business_processes', [])
     power_mapping = analysis_data.get('power_platform_mapping', {})
     
-    content = f"""# User Stories - {app_name}
+    parts = [f"""# User Stories - {app_name}
 
 ## Document Information
 - **Generated Date**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
@@ -1154,85 +1413,104 @@ async def generate_user_storie(analysis_data: Dict[str, Any]) -> str:
 
 ## Epic: {app_name} Power Platform Migration
 
-"""
+"""]
     
     story_id = 1
     
     # Generate stories for each business process
     for process in business_processes:
-        content += f"\n### Feature: {process['name']}\n\n"
+        parts.append(f"\n### Feature: {process['name']}\n\n")
         
         # Story for main process
-        content += f"""#### US-{story_id:03d}: {process['name']} - Main Process
+        parts.append(f"""#### US-{story_id:03d}: {process['name']} - Main Process
 
 **As a** {', '.join(process.get('workflow_steps', [{}])[0].get('roles', ['User'])) if process.get('workflow_steps') else 'User'}
 **I want to** execute the {process['name']} process
 **So that** I can complete my business operations efficiently
 
 **Acceptance Criteria:**
-"""
+""")
         story_id += 1
         
         crud = process.get('crud_operations', {})
-        for action in crud.get('read', []):
-            content += f"- [ ] User can view {action} data\n"
-        
-        for action in crud.get('create', []):
-            content += f"- [ ] User can create new {action} records\n"
-        
-        for action in crud.get('update', []):
-            content += f"- [ ] User can update existing {action} records\n"
-        
-        for action in crud.get('delete', []):
-            content += f"- [ ] User can delete {action} records\n"
+        parts.extend(f"- [ ] User can view {action} data\n" for action in crud.get('read', []))
+        parts.extend(f"- [ ] User can create new {action} records\n" for action in crud.get('create', []))
+        parts.extend(f"- [ ] User can update existing {action} records\n" for action in crud.get('update', []))
+        parts.extend(f"- [ ] User can delete {action} records\n" for action in crud.get('delete', []))
         
-        content += f"\n**Story Points**: {process.get('total_actions', 0) * 2}\n"
-        content += f"**Priority**: {'High' if process['complexity'] == 'High' else 'Medium'}\n\n"
-        content += "---\n"
+        parts.append(f"\n**Story Points**: {process.get('total_actions', 0) * 2}\n")
+        parts.append(f"**Priority**: {'High' if process['complexity'] == 'High' else 'Medium'}\n\n")
+        parts.append("---\n")
     
-    return content
+    return ''.join(parts)
 
 
 async def generate_test_cases(retrieved: List[Dict[str, Any]], 
                          nodes: List[Dict[str, Any]], 
                          metrics: Dict[str, Any] = None,
                          business_processes: List[Dict[str, Any]] = None,
-                         power_platform_mapping: Dict[str, Any] = None) -> str:
-    """Generate functional test cases documentation"""
+                         power_platform_mapping: Dict[str, Any] = None,
+                         formatted: Tuple[str, str, str, str] = None,
+                         context: str = None) -> str:
+    """Generate functional test cases documentation (formatted / context: prebuilt for these same inputs)"""
     
-    graph_summary = summarize_graph_enhanced(nodes)
-    context = _make_context_snippets(retrieved, max_chars=15000)
+    graph_summary, metrics_summary, processes_summary, mapping_summary = (
+        formatted or _format_analysis(nodes, metrics, business_processes, power_platform_mapping)
+    )
+    context = context or _make_context_snippets(retrieved, max_tokens=CONTEXT_TOKEN_BUDGETS["test_cases"])
     
-    # Format additional context
-    metrics_summary = format_metrics_summary(metrics or {})
-    processes_summary = format_business_processes(business_processes or [])
-    mapping_summary = format_power_platform_mapping(power_platform_mapping or {})
+    messages = _build_document_messages(
+        "Generate comprehensive test case documentation for .NET to Power Platform migration. Create functional test scenarios with test steps, expected results, and test data.",
+        graph_summary, metrics_summary, processes_summary, mapping_summary, context
+    )
     
-    messages = [
-        {"role": "system", "content": "Generate comprehensive test case documentation for .NET to Power Platform migration. Create functional test scenarios with test steps, expected results, and test data."},
-        {"role": "user", "content": f"""
-        GRAPH:
-        {graph_summary}
+    return await asyncio.to_thread(_chat, messages, temperature=0.1, model=CHEAP_CHAT_DEPLOY)
 
-        {metrics_summary}
 
-        {processes_summary}
+# Tab 6 documents that take (retrieved, nodes, metrics, business_processes,
+# power_platform_mapping), in UI order, with their CONTEXT_TOKEN_BUDGETS key
+ANALYSIS_DOCUMENT_GENERATORS = {
+    generate_business_flows: "flows",
+    generate_tables_analysis: "tables",
+    generate_user_journeys: "journeys",
+    generate_personas: "personas",
+    generate_test_cases: "test_cases",
+}
 
-        {mapping_summary}
 
-        CONTEXT SNIPPETS:
-        {context}
-        """}
-    ]
+async def generate_analysis_documents(retrieved: List[Dict[str, Any]],
+                                      nodes: List[Dict[str, Any]],
+                                      metrics: Dict[str, Any] = None,
+                                      business_processes: List[Dict[str, Any]] = None,
+                                      power_platform_mapping: Dict[str, Any] = None,
+                                      generators=ANALYSIS_DOCUMENT_GENERATORS) -> List[Any]:
+    """
+    Run several Tab 6 generators (keys of ANALYSIS_DOCUMENT_GENERATORS)
+    concurrently, at most DOCUMENT_MAX_CONCURRENCY LLM calls at a time. The
+    analysis summaries are formatted once and the context snippets built
+    once per token budget, then shared.
+    Results come back in generator order; a generator that fails yields its
+    exception, so the other documents are kept.
+    """
+    formatted = _format_analysis(nodes, metrics, business_processes, power_platform_mapping)
+    budgets = {generate: CONTEXT_TOKEN_BUDGETS[ANALYSIS_DOCUMENT_GENERATORS[generate]] for generate in generators}
+    contexts = {budget: _make_context_snippets(retrieved, max_tokens=budget) for budget in set(budgets.values())}
+    slots = asyncio.Semaphore(DOCUMENT_MAX_CONCURRENCY)
     
-    return _chat(messages, temperature=0.1)
+    async def run(generate):
+        async with slots:
+            return await generate(retrieved, nodes, metrics, business_processes, power_platform_mapping,
+                                  formatted=formatted, context=contexts[budgets[generate]])
+    
+    return await asyncio.gather(*(run(generate) for generate in generators), return_exceptions=True)
 
 
 async def generate_complete_brd_async(analysis_data: Dict[str, Any]) -> str:
     """Generate complete BRD with all sections (async wrapper for compatibility)"""
     
-    # This is a compatibility function - the main generate_brd already does everything
-    return generate_brd(
+    # This is a compatibility function - generate_brd_async already does everything.
+    # (generate_brd would block the event loop, and its asyncio.run fails inside one)
+    return await generate_brd_async(
         analysis_data.get('retrieved', []),
         analysis_data.get('nodes', []),
         analysis_data.get('metrics', {}),
@@ -1245,26 +1523,10 @@ async def generate_complete_brd_async(analysis_data: Dict[str, Any]) -> str:
 # COPILOT PROMPT LIBRARY GENERATOR (OPTIONAL ENHANCEMENT)
 # ============================================================
 
-def generate_copilot_prompt_library(
-    retrieved: List[Dict[str, Any]],
-    nodes: List[Dict[str, Any]],
-    metrics: Dict[str, Any],
-    business_processes: List[Dict[str, Any]],
-    power_platform_mapping: Dict[str, Any]
-) -> Dict[str, Any]:
-    """
-    Generate comprehensive, copy-paste ready Copilot prompts.
-    Uses GPT-4 to create natural language instructions for each component.
-    """
-    
-    # Prepare context
-    graph_summary = summarize_graph_enhanced(nodes)
-    context_snippets = _make_context_snippets(retrieved, max_chars=8000)
-    processes_summary = format_business_processes(business_processes or [])
-    mapping_summary = format_power_platform_mapping(power_platform_mapping or {})
-    
-    # Enhanced system prompt for Copilot prompt generation
-    system_prompt = """You are an expert at creating natural language prompts for Microsoft Copilot tools in Power Platform.
+# Static system prompt for Copilot prompt generation. Kept byte-identical
+# across calls so Azure OpenAI serves it from its prompt cache; everything
+# that varies per application goes in the user message after it.
+COPILOT_SYSTEM_PROMPT = """You are an expert at creating natural language prompts for Microsoft Copilot tools in Power Platform.
 
 Your task: Generate ready-to-use prompts that developers can copy-paste directly into:
 1. Copilot in Power Apps (canvas apps)
@@ -1297,19 +1559,11 @@ OUTPUT FORMAT: Valid JSON only with this structure:
     "power_automate_prompts": [...]
 }"""
 
-    user_prompt = f"""Generate Copilot prompts for migrating this .NET application to Power Platform.
-
-ANALYZED CODE STRUCTURE:
-{graph_summary}
-
-BUSINESS PROCESSES:
-{processes_summary}
 
-POWER PLATFORM MAPPING:
-{mapping_summary}
-
-CODE SAMPLES:
-{context_snippets[:3000]}
+# Fixed instructions that open every Copilot library user message; the
+# per-application analysis follows them so the whole header stays in the
+# cached prompt prefix.
+COPILOT_USER_PROMPT_HEADER = """Generate Copilot prompts for migrating the .NET application analyzed below to Power Platform.
 
 Generate prompts for:
 1. **Top 5 Dataverse Tables** (most important entities)
@@ -1329,9 +1583,44 @@ CRITICAL: Each prompt must be complete enough that a developer can paste it into
 
 Return ONLY valid JSON, no markdown formatting."""
 
+
+def generate_copilot_prompt_library(
+    retrieved: List[Dict[str, Any]],
+    nodes: List[Dict[str, Any]],
+    metrics: Dict[str, Any],
+    business_processes: List[Dict[str, Any]],
+    power_platform_mapping: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Generate comprehensive, copy-paste ready Copilot prompts.
+    Uses GPT-4 to create natural language instructions for each component.
+    """
+    
+    # Prepare context
+    graph_summary = summarize_graph_enhanced(nodes)
+    context_snippets = _make_context_snippets(retrieved, max_tokens=CONTEXT_TOKEN_BUDGETS["copilot"])
+    processes_summary = format_business_processes(business_processes or [])
+    mapping_summary = format_power_platform_mapping(power_platform_mapping or {})
+    
+    user_prompt = f"""{COPILOT_USER_PROMPT_HEADER}
+
+---ANALYSIS---
+
+ANALYZED CODE STRUCTURE:
+{graph_summary}
+
+BUSINESS PROCESSES:
+{processes_summary}
+
+POWER PLATFORM MAPPING:
+{mapping_summary}
+
+CODE SAMPLES:
+{context_snippets}"""
+
     # Call GPT-4 with structured output
     messages = [
-        {"role": "system", "content": system_prompt},
+        {"role": "system", "content": COPILOT_SYSTEM_PROMPT},
         {"role": "user", "content": user_prompt}
     ]
     
@@ -1339,22 +1628,22 @@ Return ONLY valid JSON, no markdown formatting."""
     
     # Parse response (handle potential JSON errors)
     try:
-        library = json.loads(response)
-    except json.JSONDecodeError:
+        library = orjson.loads(response)
+    except orjson.JSONDecodeError:
         # Fallback: extract JSON from markdown code blocks
-        json_match = re.search(r'```(?:json)?\s*(.*?)\s*```', response, re.DOTALL)
+        json_match = _FENCED_JSON_RE.search(response)
         if json_match:
             try:
-                library = json.loads(json_match.group(1))
-            except:
+                library = orjson.loads(json_match.group(1))
+            except orjson.JSONDecodeError:
                 library = {"error": "JSON parse failed", "raw_response": response[:500]}
         else:
             # Last attempt: find JSON object
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
-            if json_match:
+            json_block = _scan_balanced(response, '{', '}')
+            if json_block:
                 try:
-                    library = json.loads(json_match.group(0))
-                except:
+                    library = orjson.loads(json_block)
+                except orjson.JSONDecodeError:
                     library = {"error": "Could not extract JSON"}
             else:
                 library = {
@@ -1365,19 +1654,17 @@ Return ONLY valid JSON, no markdown formatting."""
                     "raw_response": response[:500]
                 }
     
-    # Ensure all expected keys exist
-    library.setdefault("dataverse_prompts", [])
-    library.setdefault("power_apps_prompts", [])
-    library.setdefault("power_automate_prompts", [])
+    # Ensure all expected keys exist (and hold lists)
+    for key in ("dataverse_prompts", "power_apps_prompts", "power_automate_prompts"):
+        if not isinstance(library.get(key), list):
+            library[key] = []
     
     # Add metadata
-    import pandas as pd
     library["metadata"] = {
-        "generated_date": pd.Timestamp.now().isoformat(),
-        "total_prompts": sum(
-            len(v) for k, v in library.items() 
-            if isinstance(v, list) and k.endswith('_prompts')
-        ),
+        "generated_date": datetime.now(timezone.utc).isoformat(),
+        "total_prompts": (len(library["dataverse_prompts"])
+                          + len(library["power_apps_prompts"])
+                          + len(library["power_automate_prompts"])),
         "source_files": len(nodes),
         "business_processes": len(business_processes or []),
         "entities_analyzed": len(power_platform_mapping.get('dataverse_tables', []))
@@ -1386,111 +1673,87 @@ Return ONLY valid JSON, no markdown formatting."""
     return library
 
 
-def format_copilot_library_as_markdown(library: Dict[str, Any]) -> str:
-    """Convert JSON library to readable Markdown for download"""
+# (library key, section heading Markdown, default estimated time)
+_COPILOT_LIBRARY_SECTIONS = (
+    ('dataverse_prompts',
+     "## 📊 Dataverse Table Creation Prompts\n\n*Copy-paste these into **Copilot in Dataverse***\n\n",
+     '15-20 min'),
+    ('power_apps_prompts',
+     "## 📱 Power Apps Canvas Screen Prompts\n\n*Copy-paste these into **Copilot in Power Apps***\n\n",
+     '20-30 min'),
+    ('power_automate_prompts',
+     "## ⚡ Power Automate Flow Prompts\n\n*Copy-paste these into **Copilot in Power Automate***\n\n",
+     '30-40 min'),
+)
+
+# One library entry in the Markdown export
+_COPILOT_PROMPT_MD = (
+    "### {i}. {title} {emoji}\n\n"
+    "**Priority:** {priority} | **Estimated Time:** {time}\n\n"
+    "**📋 Copilot Prompt:**\n\n"
+    "```\n{prompt}\n```\n\n"
+    "**✅ Validation Checklist:**\n\n"
+    "{checklist}"
+    "\n---\n\n"
+)
+
+
+# Closing section of the Markdown export (static)
+_COPILOT_QUICK_START_MD = (
+    "## 🚀 Quick Start Guide\n\n"
+    "### How to Use These Prompts:\n\n"
+    "1. **Copy** the prompt text from inside the code block above\n"
+    "2. **Open** the corresponding Copilot tool in Power Platform\n"
+    "3. **Paste** the entire prompt into the Copilot input box\n"
+    "4. **Press Enter** and wait for Copilot to generate the component\n"
+    "5. **Review** the generated result and make minor adjustments if needed\n"
+    "6. **Validate** using the checklist provided with each prompt\n"
+    "7. **Test** the component with sample data\n\n"
+    "### 💡 Tips for Best Results:\n\n"
+    "- **Follow the order:** Create Dataverse tables first, then apps, then flows\n"
+    "- **Validate each step:** Check off the validation items before proceeding\n"
+    "- **Customize as needed:** These prompts are starting points\n"
+    "- **Test incrementally:** Don't build everything at once\n\n"
+    "---\n\n"
+    "*Generated by .NET to Power Platform Migration Assistant*\n"
+)
+
+
+def iter_copilot_library_markdown(library: Dict[str, Any]):
+    """Yield the Markdown export of a Copilot library piece by piece"""
     
-    md_parts = [
-        f"# 🤖 Copilot Prompt Library\n\n",
-        f"**Generated:** {library['metadata']['generated_date']}\n",
-        f"**Total Prompts:** {library['metadata']['total_prompts']}\n",
-        f"**Source Files Analyzed:** {library['metadata']['source_files']}\n",
-        f"**Business Processes:** {library['metadata']['business_processes']}\n\n",
-        "---\n\n"
-    ]
+    metadata = library['metadata']
+    yield (f"# 🤖 Copilot Prompt Library\n\n"
+           f"**Generated:** {metadata['generated_date']}\n"
+           f"**Total Prompts:** {metadata['total_prompts']}\n"
+           f"**Source Files Analyzed:** {metadata['source_files']}\n"
+           f"**Business Processes:** {metadata['business_processes']}\n\n"
+           "---\n\n")
     
-    # Dataverse section
-    if library.get('dataverse_prompts'):
-        md_parts.append("## 📊 Dataverse Table Creation Prompts\n\n")
-        md_parts.append("*Copy-paste these into **Copilot in Dataverse***\n\n")
+    for key, heading, default_time in _COPILOT_LIBRARY_SECTIONS:
+        prompts = library.get(key)
+        if not prompts:
+            continue
         
-        for i, prompt in enumerate(library['dataverse_prompts'], 1):
-            priority_emoji = "🔴" if prompt.get('priority') == 'HIGH' else "🟡" if prompt.get('priority') == 'MEDIUM' else "🟢"
-            
-            md_parts.extend([
-                f"### {i}. {prompt.get('title', 'Untitled')} {priority_emoji}\n\n",
-                f"**Priority:** {prompt.get('priority', 'MEDIUM')} | ",
-                f"**Estimated Time:** {prompt.get('estimated_time', '15-20 min')}\n\n",
-                "**📋 Copilot Prompt:**\n\n",
-                "```\n",
-                prompt.get('prompt', 'N/A'),
-                "\n```\n\n",
-                "**✅ Validation Checklist:**\n\n"
-            ])
-            
-            for check in prompt.get('validation', []):
-                md_parts.append(f"- [ ] {check}\n")
-            
-            md_parts.append("\n---\n\n")
-    
-    # Power Apps section
-    if library.get('power_apps_prompts'):
-        md_parts.append("## 📱 Power Apps Canvas Screen Prompts\n\n")
-        md_parts.append("*Copy-paste these into **Copilot in Power Apps***\n\n")
-        
-        for i, prompt in enumerate(library['power_apps_prompts'], 1):
-            priority_emoji = "🔴" if prompt.get('priority') == 'HIGH' else "🟡" if prompt.get('priority') == 'MEDIUM' else "🟢"
-            
-            md_parts.extend([
-                f"### {i}. {prompt.get('title', 'Untitled')} {priority_emoji}\n\n",
-                f"**Priority:** {prompt.get('priority', 'MEDIUM')} | ",
-                f"**Estimated Time:** {prompt.get('estimated_time', '20-30 min')}\n\n",
-                "**📋 Copilot Prompt:**\n\n",
-                "```\n",
-                prompt.get('prompt', 'N/A'),
-                "\n```\n\n",
-                "**✅ Validation Checklist:**\n\n"
-            ])
-            
-            for check in prompt.get('validation', []):
-                md_parts.append(f"- [ ] {check}\n")
-            
-            md_parts.append("\n---\n\n")
-    
-    # Power Automate section
-    if library.get('power_automate_prompts'):
-        md_parts.append("## ⚡ Power Automate Flow Prompts\n\n")
-        md_parts.append("*Copy-paste these into **Copilot in Power Automate***\n\n")
+        yield heading
         
-        for i, prompt in enumerate(library['power_automate_prompts'], 1):
-            priority_emoji = "🔴" if prompt.get('priority') == 'HIGH' else "🟡" if prompt.get('priority') == 'MEDIUM' else "🟢"
+        for i, prompt in enumerate(prompts, 1):
+            priority = prompt.get('priority', 'MEDIUM')
+            checks = prompt.get('validation', ())
             
-            md_parts.extend([
-                f"### {i}. {prompt.get('title', 'Untitled')} {priority_emoji}\n\n",
-                f"**Priority:** {prompt.get('priority', 'MEDIUM')} | ",
-                f"**Estimated Time:** {prompt.get('estimated_time', '30-40 min')}\n\n",
-                "**📋 Copilot Prompt:**\n\n",
-                "```\n",
-                prompt.get('prompt', 'N/A'),
-                "\n```\n\n",
-                "**✅ Validation Checklist:**\n\n"
-            ])
-            
-            for check in prompt.get('validation', []):
-                md_parts.append(f"- [ ] {check}\n")
-            
-            md_parts.append("\n---\n\n")
-    
-    # Quick start guide
-    md_parts.extend([
-        "## 🚀 Quick Start Guide\n\n",
-        "### How to Use These Prompts:\n\n",
-        "1. **Copy** the prompt text from inside the code block above\n",
-        "2. **Open** the corresponding Copilot tool in Power Platform\n",
-        "3. **Paste** the entire prompt into the Copilot input box\n",
-        "4. **Press Enter** and wait for Copilot to generate the component\n",
-        "5. **Review** the generated result and make minor adjustments if needed\n",
-        "6. **Validate** using the checklist provided with each prompt\n",
-        "7. **Test** the component with sample data\n\n",
-        "### 💡 Tips for Best Results:\n\n",
-        "- **Follow the order:** Create Dataverse tables first, then apps, then flows\n",
-        "- **Validate each step:** Check off the validation items before proceeding\n",
-        "- **Customize as needed:** These prompts are starting points\n",
-        "- **Test incrementally:** Don't build everything at once\n\n",
-        "---\n\n",
-        "*Generated by .NET to Power Platform Migration Assistant*\n"
-    ])
+            yield _COPILOT_PROMPT_MD.format(
+                i=i,
+                title=prompt.get('title', 'Untitled'),
+                emoji=PRIORITY_EMOJI.get(priority, "🟢"),
+                priority=priority,
+                time=prompt.get('estimated_time', default_time),
+                prompt=prompt.get('prompt', 'N/A'),
+                checklist="".join(f"- [ ] {check}\n" for check in checks),
+            )
     
-    return ''.join(md_parts)
-
+    yield _COPILOT_QUICK_START_MD
 
 
+def format_copilot_library_as_markdown(library: Dict[str, Any]) -> str:
+    """Convert JSON library to readable Markdown for download"""
+    return ''.join(iter_copilot_library_markdown(library))
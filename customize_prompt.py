@@ -1,38 +1,44 @@
+import re
+
+# Module-specific enhancements
+MODULE_CONTEXT = {
+    "login": "focus on user authentication, authorization, password reset flows, and session management.",
+    "reporting": "include report generation workflows, data aggregation, scheduling, and export formats.",
+    "data migration": "describe data extraction, transformation, validation, and load processes from old systems.",
+    "dashboard": "cover KPIs, data visualization components, and role-based access to metrics.",
+    "user management": "detail roles, permissions, user provisioning, and approval workflows.",
+    "payment": "cover payment gateways, transaction validation, refund processes, and audit trails.",
+    "notification": "include alerting logic, email/SMS templates, and event triggers."
+}
+DEFAULT_MODULE_CONTEXT = "include all functional and non-functional requirements."
+
+# Any module keyword, matched case-insensitively in one pass
+_MODULE_RE = re.compile("|".join(map(re.escape, MODULE_CONTEXT)), re.IGNORECASE)
+
+
+def _module_context(prompt):
+    """
+    Context for the module keyword found in the prompt, or the generic default.
+    When several match, the one listed first in MODULE_CONTEXT wins.
+    """
+    found = {match.group(0).lower() for match in _MODULE_RE.finditer(prompt)}
+    return next((ctx for module, ctx in MODULE_CONTEXT.items() if module in found), DEFAULT_MODULE_CONTEXT)
+
+
 def customize_prompts(prompts, app_info):
     """
     Enrich base prompts with both application-level and module-specific context.
     """
 
-    # Module-specific enhancements
-    module_context = {
-        "login": "focus on user authentication, authorization, password reset flows, and session management.",
-        "reporting": "include report generation workflows, data aggregation, scheduling, and export formats.",
-        "data migration": "describe data extraction, transformation, validation, and load processes from old systems.",
-        "dashboard": "cover KPIs, data visualization components, and role-based access to metrics.",
-        "user management": "detail roles, permissions, user provisioning, and approval workflows.",
-        "payment": "cover payment gateways, transaction validation, refund processes, and audit trails.",
-        "notification": "include alerting logic, email/SMS templates, and event triggers."
-    }
-
-    customized_prompts = []
-    for base_prompt in prompts:
-        lower_p = base_prompt.lower()
-
-        # Match to module context if possible
-        matched_context = next((v for k, v in module_context.items() if k in lower_p), 
-                               "include all functional and non-functional requirements.")
-
-        # Build customized prompt
-        customized = (
-            f"{base_prompt} for the {app_info['name']} application. "
-            f"This application uses {app_info['tech_stack']} (version {app_info['version']}). "
-            f"Consider legacy aspects like {app_info['description']} and ensure BRD covers backward compatibility. "
-            f"Specifically, {matched_context}"
-        )
-
-        customized_prompts.append(customized)
-
-    return customized_prompts
+    # Application context is the same for every prompt
+    app_context = (
+        f" for the {app_info['name']} application. "
+        f"This application uses {app_info['tech_stack']} (version {app_info['version']}). "
+        f"Consider legacy aspects like {app_info['description']} and ensure BRD covers backward compatibility. "
+        f"Specifically, "
+    )
+
+    return [base_prompt + app_context + _module_context(base_prompt) for base_prompt in prompts]
 
 
 # Example usage
@@ -1,10 +1,30 @@
 from utils import chunk_document_safe
-import json, re, time
+import json, time
 from docx import Document
 from docx.shared import Pt, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 import io
 from datetime import datetime
+import csv
+import os
+from dataclasses import dataclass, field
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import zipfile
+import numpy as np
+import faiss
+from rag_index import (
+    load_faiss_index,
+    add_in_batches,
+    append_metadata,
+    count_metadata,
+    create_faiss_index,
+    ivfdata_path,
+    meta_db_path,
+    save_index_and_metadata,
+    write_metadata,
+)
 
 def validate_uploaded_brd(brd_text: str, seed_results: list) -> dict:
     """
@@ -107,12 +127,12 @@ Validate strictly: Does this BRD chunk describe the SAME system as the repositor
                     {"role": "user", "content": prompt}
                 ], temperature=0.1)
 
-                # Extract JSON from response
-                json_match = re.search(r"\{.*\}", response_text, re.DOTALL)
-                if not json_match:
+                # Extract the first balanced JSON object (prose after it may contain braces)
+                json_block = _scan_balanced(response_text, '{', '}')
+                if json_block is None:
                     raise ValueError("No JSON object found in model output")
 
-                parsed = json.loads(json_match.group(0))
+                parsed = json.loads(json_block)
 
                 # Normalize structure
                 if "sections" not in parsed or not isinstance(parsed["sections"], list):
@@ -654,38 +674,47 @@ with tab8:
 
 
 from utils import chunk_document_safe
-import json, re, time
+import json, time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from docx import Document
 from docx.shared import Pt, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 import io
 from datetime import datetime
 
-def validate_uploaded_brd(brd_text: str, seed_results: list) -> dict:
-    """
-    ✅ Enhanced BRD validation with dynamic section detection and detailed failure reasons.
-    Validates uploaded BRD (supports 100+ pages) against repository insights.
-    Uses shared _chat() for Azure GPT-4.1-mini.
-    """
-
-    # --- Context summary (limit safely) ---
-    context_summary = "\n\n".join([r.get("text", "")[:2000] for r in seed_results[:10]])
-
-    # --- Chunk entire BRD (~9k tokens each ≈ 20–25 pages) ---
-    brd_chunks = chunk_document_safe(brd_text, max_tokens=9000)
-    total_chunks = len(brd_chunks)
-    print(f"🧾 Validating BRD ({total_chunks} chunks, full coverage)...")
-
-    all_results = []
-
-    for i, chunk in enumerate(brd_chunks, start=1):
-        prompt = f"""
+# BRD chunks validated concurrently by one validate_uploaded_brd call
+BRD_VALIDATE_WORKERS = 8
+# _chat() validation calls in flight across all callers (Streamlit sessions
+# share one deployment and its requests-per-minute limit)
+BRD_VALIDATE_MAX_INFLIGHT = 8
+_BRD_VALIDATE_SLOTS = threading.Semaphore(BRD_VALIDATE_MAX_INFLIGHT)
+# Tokens per BRD validation chunk (~20-25 pages, the size validation has
+# always used). Each chunk is sent as at most 8500 characters, so text past
+# that is not validated (logged below); ~1500 covers every word, at roughly
+# 6x the chunks and calls
+BRD_VALIDATE_CHUNK_TOKENS = int(os.getenv("BRD_VALIDATE_CHUNK_TOKENS", "9000"))
+# BRD chunks sent together in one _chat() call; the repository context and
+# instructions are then sent once per batch instead of once per chunk
+BRD_VALIDATE_BATCH = 4
+# Validation replies remembered for byte-identical requests (e.g. repeated
+# template pages, or the same BRD validated again)
+BRD_VALIDATE_MEMO_SIZE = 256
+
+_BRD_VALIDATE_SYSTEM = "You are an enterprise BRD validator. Respond only in valid JSON format."
+
+# Everything in a validation request that does not depend on the chunk. It
+# leads the first user message, followed only by the repository context, so
+# that message is identical for every call on a BRD and the deployment's
+# prompt cache can reuse its prefill; the chunk text goes in a second message.
+_BRD_VALIDATE_INSTRUCTIONS = """
 You are a senior BRD validator with expertise in software requirements analysis.
 
-Compare this BRD content chunk ({i}/{total_chunks}) with the provided repository context.
+Compare each BRD content chunk you are given with the provided repository context.
 
 **CRITICAL INSTRUCTIONS:**
-1. IDENTIFY all sections present in this chunk (e.g., Executive Summary, Objectives, Scope, 
+1. IDENTIFY all sections present in the chunk (e.g., Executive Summary, Objectives, Scope, 
    Assumptions, Constraints, Risks, Functional Requirements, Non-Functional Requirements, 
    User Stories, Use Cases, APIs, Data Models, Security Requirements, etc.)
    
@@ -697,85 +726,179 @@ Compare this BRD content chunk ({i}/{total_chunks}) with the provided repository
      * What technical gaps exist
      * Concrete examples of discrepancies
 
-3. Respond ONLY in valid JSON format with this exact structure:
+3. Respond ONLY in valid JSON. Each chunk's result has this exact structure:
 
-{{
+{
   "status": "valid" or "invalid",
   "summary": "Brief 1-2 sentence evaluation of this chunk's alignment",
   "sections": [
-    {{
+    {
       "name": "Exact section name from BRD",
       "status": "pass" or "fail",
       "reason": "Detailed, specific explanation (MANDATORY for fail status). Include concrete examples and technical details.",
       "confidence": "high" or "medium" or "low"
-    }}
+    }
   ],
   "detected_sections_count": <number of sections identified>,
   "critical_issues": ["List of critical misalignments if any"]
-}}
+}
 
 **VALIDATION RULES:**
-- Only include sections that ACTUALLY appear in this chunk
+- Only include sections that ACTUALLY appear in the chunk
 - For PASS: Confirm alignment with specific details
 - For FAIL: Provide detailed, actionable reasons with examples
 - Use "confidence" to indicate validation certainty
 - Flag "critical_issues" for major problems (security gaps, conflicting requirements, etc.)
 
 --- REPOSITORY CONTEXT ---
-{context_summary}
+"""
+
 
---- BRD CHUNK ({i}/{total_chunks}) ---
+@lru_cache(maxsize=BRD_VALIDATE_MEMO_SIZE)
+def _validation_reply(context_prompt: str, request: str) -> str:
+    """
+    JSON object text from _chat() for one validation request, memoized on
+    the exact prompt. Failed calls and replies without valid JSON raise,
+    so they are not remembered and a retry asks the model again.
+    """
+    with _BRD_VALIDATE_SLOTS:
+        response_text = _chat([
+            {"role": "system", "content": _BRD_VALIDATE_SYSTEM},
+            {"role": "user", "content": context_prompt},
+            {"role": "user", "content": request}
+        ], temperature=0.1)
+
+    # Extract the first balanced JSON object (prose after it may contain braces)
+    json_block = _scan_balanced(response_text, '{', '}')
+    if json_block is None:
+        raise ValueError("No JSON object found in model output")
+    json.loads(json_block)  # raises on malformed JSON
+    return json_block
+
+
+def _normalize_chunk_result(parsed: dict, i: int) -> dict:
+    """Fill in the fields aggregation relies on and tag the result with its chunk"""
+    if "sections" not in parsed or not isinstance(parsed["sections"], list):
+        parsed["sections"] = []
+    if "critical_issues" not in parsed:
+        parsed["critical_issues"] = []
+    if "detected_sections_count" not in parsed:
+        parsed["detected_sections_count"] = len(parsed["sections"])
+    parsed["chunk_id"] = i
+    return parsed
+
+
+def _validate_chunk(i: int, chunk: str, context_prompt: str, total_chunks: int) -> dict:
+    """
+    Validate one BRD chunk with up to 3 _chat() attempts.
+    Returns the parsed result (tagged with chunk_id), or a fallback
+    failure entry when every attempt fails.
+    """
+    # No chunk number in the request, so repeated chunks hit the reply memo
+    request = f"""--- BRD CHUNK ---
 {chunk[:8500]}
 
+Respond with the result object for this chunk.
 Remember: Be thorough, specific, and provide actionable feedback for any failures.
 """
 
-        # --- Retry logic using _chat() ---
-        for attempt in range(3):
-            try:
-                response_text = _chat([
-                    {"role": "system", "content": "You are an enterprise BRD validator. Respond only in valid JSON format."},
-                    {"role": "user", "content": prompt}
-                ], temperature=0.1)
+    # --- Retry logic using _chat() ---
+    for attempt in range(3):
+        try:
+            # Parsed afresh on every call, so memoized replies never share dicts
+            parsed = _normalize_chunk_result(json.loads(_validation_reply(context_prompt, request)), i)
+            print(f"✓ Chunk {i}/{total_chunks} validated ({parsed['detected_sections_count']} sections found)")
+            return parsed
+            
+        except Exception as e:
+            print(f"⚠️ Chunk {i}/{total_chunks} failed (attempt {attempt+1}): {e}")
+            time.sleep(2 + attempt)
+            if attempt == 2:
+                # Fallback entry when the model fails 3 times
+                return {
+                    "chunk_id": i,
+                    "status": "invalid",
+                    "summary": f"Chunk {i} failed validation due to model or parsing errors after 3 attempts.",
+                    "sections": [{
+                        "name": "Validation Error",
+                        "status": "fail",
+                        "reason": f"Technical error during validation: {str(e)}. Unable to process this section of the BRD.",
+                        "confidence": "low"
+                    }],
+                    "detected_sections_count": 0,
+                    "critical_issues": ["Validation process failure"]
+                }
 
-                # Extract JSON from response
-                json_match = re.search(r"\{.*\}", response_text, re.DOTALL)
-                if not json_match:
-                    raise ValueError("No JSON object found in model output")
 
-                parsed = json.loads(json_match.group(0))
+def _validate_batch(batch: list, context_prompt: str, total_chunks: int) -> list:
+    """
+    Validate several (chunk number, chunk) pairs with a single _chat() call.
+    Chunks missing from the reply, or the whole batch when the call or its
+    JSON fails, are retried one at a time through _validate_chunk.
+    """
+    if len(batch) == 1:
+        return [_validate_chunk(batch[0][0], batch[0][1], context_prompt, total_chunks)]
 
-                # Normalize structure
-                if "sections" not in parsed or not isinstance(parsed["sections"], list):
-                    parsed["sections"] = []
-                if "critical_issues" not in parsed:
-                    parsed["critical_issues"] = []
-                if "detected_sections_count" not in parsed:
-                    parsed["detected_sections_count"] = len(parsed["sections"])
+    numbers = [i for i, _ in batch]
+    chunk_blocks = "\n\n".join(
+        f"--- BRD CHUNK {i}/{total_chunks} ---\n{chunk[:8500]}" for i, chunk in batch
+    )
+    request = f"""{chunk_blocks}
 
-                parsed["chunk_id"] = i
-                all_results.append(parsed)
-                print(f"✓ Chunk {i}/{total_chunks} validated ({parsed['detected_sections_count']} sections found)")
-                break
-                
-            except Exception as e:
-                print(f"⚠️ Chunk {i}/{total_chunks} failed (attempt {attempt+1}): {e}")
-                time.sleep(2 + attempt)
-                if attempt == 2:
-                    # Fallback entry when the model fails 3 times
-                    all_results.append({
-                        "chunk_id": i,
-                        "status": "invalid",
-                        "summary": f"Chunk {i} failed validation due to model or parsing errors after 3 attempts.",
-                        "sections": [{
-                            "name": "Validation Error",
-                            "status": "fail",
-                            "reason": f"Technical error during validation: {str(e)}. Unable to process this section of the BRD.",
-                            "confidence": "low"
-                        }],
-                        "detected_sections_count": 0,
-                        "critical_issues": ["Validation process failure"]
-                    })
+Validate each chunk above independently of the others. Respond with
+{{"results": [...]}} holding one result object per chunk, each with an added
+"chunk_id" field set to the chunk number from its header.
+Remember: Be thorough, specific, and provide actionable feedback for any failures.
+"""
+
+    results = {}
+    try:
+        for entry in json.loads(_validation_reply(context_prompt, request)).get("results", []):
+            i = entry.get("chunk_id") if isinstance(entry, dict) else None
+            if isinstance(i, str) and i.isdigit():
+                i = int(i)
+            if i in numbers and i not in results:
+                results[i] = _normalize_chunk_result(entry, i)
+                print(f"✓ Chunk {i}/{total_chunks} validated ({results[i]['detected_sections_count']} sections found)")
+    except Exception as e:
+        print(f"⚠️ Chunks {numbers[0]}-{numbers[-1]}/{total_chunks} failed as a batch: {e}; validating one by one")
+
+    return [results[i] if i in results else _validate_chunk(i, chunk, context_prompt, total_chunks)
+            for i, chunk in batch]
+
+
+def validate_uploaded_brd(brd_text: str, seed_results: list) -> dict:
+    """
+    ✅ Enhanced BRD validation with dynamic section detection and detailed failure reasons.
+    Validates uploaded BRD (supports 100+ pages) against repository insights.
+    Uses shared _chat() for Azure GPT-4.1-mini; chunks are validated in
+    batches of BRD_VALIDATE_BATCH, with batches sent concurrently.
+    """
+
+    # --- Context summary (limit safely) ---
+    context_summary = "\n\n".join([r.get("text", "")[:2000] for r in seed_results[:10]])
+
+    # --- Chunk entire BRD (BRD_VALIDATE_CHUNK_TOKENS each, batched per call) ---
+    brd_chunks = chunk_document_safe(brd_text, max_tokens=BRD_VALIDATE_CHUNK_TOKENS)
+    total_chunks = len(brd_chunks)
+    truncated = sum(len(chunk) > 8500 for chunk in brd_chunks)
+    coverage = "full coverage" if not truncated else f"{truncated} chunks truncated to 8500 chars"
+    print(f"🧾 Validating BRD ({total_chunks} chunks, {coverage})...")
+
+    # Same first user message for every request on this BRD (prompt-cache prefix)
+    context_prompt = _BRD_VALIDATE_INSTRUCTIONS + context_summary
+
+    numbered = list(enumerate(brd_chunks, start=1))
+    batches = [numbered[k:k + BRD_VALIDATE_BATCH] for k in range(0, total_chunks, BRD_VALIDATE_BATCH)]
+
+    all_results = []
+    max_workers = min(BRD_VALIDATE_WORKERS, len(batches)) or 1
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_validate_batch, batch, context_prompt, total_chunks)
+                   for batch in batches]
+        for fut in as_completed(futures):
+            all_results.extend(fut.result())
+    all_results.sort(key=lambda r: r["chunk_id"])  # completion order varies
 
     if not all_results:
         return {
@@ -1123,134 +1246,406 @@ def generate_brd_validation_docx(result: dict, seed_results: list) -> bytes:
 
 
 
-def add_documents_to_index(
-    index_path: str,
-    new_docs: List[Dict[str, Any]],
-    use_checkpoint: bool = True
-) -> None:
+# Worker threads used to normalize supporting documents before embedding
+NORMALIZE_MAX_WORKERS = min(8, os.cpu_count() or 1)
+# Segments embedded and added to the index per step when appending; bounds
+# how many embedding vectors are held in memory at once
+APPEND_EMBED_GROUP = 2048
+# Chunks whose 64-bit SimHashes differ in at most this many bits are treated
+# as near-duplicates and embedded once
+SIMHASH_MAX_DISTANCE = 3
+# Excel readers tried in order: Rust-backed calamine (python-calamine), then
+# pandas' default for the file type (openpyxl / xlrd)
+EXCEL_ENGINES = ("calamine", None)
+# Rows pandas formats per write when serializing a full sheet to CSV bytes
+CSV_WRITE_CHUNK_ROWS = 50_000
+# zstd level for the full-sheet CSV bytes kept in chunk metadata
+SHEET_CSV_ZSTD_LEVEL = 3
+
+try:
+    import zstandard
+except ImportError:  # sheet CSV bytes are stored uncompressed without it
+    zstandard = None
+
+
+def _open_excel(excel_bytes: bytes):
+    """Open a workbook with the first Excel engine that can read it"""
+    last_error = None
+    for engine in EXCEL_ENGINES:
+        try:
+            return pd.ExcelFile(io.BytesIO(excel_bytes), engine=engine)
+        except Exception as e:  # engine not installed or can't read this format
+            last_error = e
+    raise last_error
+
+
+def _sheet_csv_bytes(df) -> bytes:
     """
-    Add new documents to existing index with validation.
-    Now supports Excel (.xls/.xlsx) supporting docs in the same way
-    as build_faiss_index (per-sheet chunking + rich metadata).
+    Full sheet as UTF-8 CSV bytes. Uses pyarrow's multi-threaded C++ writer when
+    available; pandas (chunked, straight to bytes) for mixed-type columns Arrow
+    can't convert or when pyarrow isn't installed.
     """
-    print(f"\n➕ Adding {len(new_docs)} documents to existing index...")
+    buf = io.BytesIO()
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+        pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buf)
+        return buf.getvalue()
+    except Exception:
+        buf = io.BytesIO()
+    df.to_csv(buf, index=False, encoding="utf-8", chunksize=CSV_WRITE_CHUNK_ROWS)
+    return buf.getvalue()
 
-    # Load existing index + metadata
-    index, texts, metadata, _, _ = load_faiss_index(index_path)
 
-    new_texts: List[str] = []
-    new_metadata: List[Dict[str, Any]] = []
+def _sheet_csv_text(df, headers: List[str]) -> str:
+    """Sheet as CSV text: the given header line, then the rows via the C csv writer"""
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(headers)
+    # Blank out NaN/NaT column-wise, then let the C csv writer emit the rows
+    values = df.astype(object).where(df.notna(), "")
+    writer.writerows(values.itertuples(index=False, name=None))
+    return buf.getvalue()
 
-    def _sliding_window_text_simple(text: str, size: int = 1800, overlap_chars: int = 200) -> List[str]:
-        step = max(1, size - overlap_chars)
-        out = []
-        for i in range(0, len(text), step):
-            out.append(text[i:i + size])
-            if i + size >= len(text):
-                break
-        return out
 
-    print("📄 Normalizing new documents (including Excel if present)...")
+def _pack_sheet_csv(raw: bytes) -> Tuple[bytes, Optional[str]]:
+    """Compress sheet CSV bytes for storage; returns (data, codec)"""
+    if zstandard is None:
+        return raw, None
+    return zstandard.ZstdCompressor(level=SHEET_CSV_ZSTD_LEVEL).compress(raw), "zstd"
 
-    for doc in new_docs:
-        # Figure out filename / extension
-        file_name = doc.get("source") or doc.get("title") or doc.get("file_name") or "document"
-        file_ext = (doc.get("ext") or "").lower()
-
-        # Heuristic to detect Excel supporting docs (same as build_faiss_index)
-        is_excel = (
-            file_ext in (".xlsx", ".xls")
-            or str(file_name).lower().endswith((".xlsx", ".xls"))
-            or doc.get("file_bytes")
-            or doc.get("content_bytes")
-            or (doc.get("file_path") and str(doc.get("file_path")).lower().endswith((".xlsx", ".xls")))
-        )
 
-        # === Excel path ======================================================
-        if is_excel:
-            print(f"📊 Detected Excel document for append: {file_name}")
+def _pack_sheet_csv_text(text: str) -> Tuple[bytes, Optional[str]]:
+    """
+    Like _pack_sheet_csv for CSV already held as text: encodes slice by slice
+    into the compressor, so no second full-size (encoded) copy is built.
+    """
+    if zstandard is None:
+        return text.encode("utf-8"), None
+    cobj = zstandard.ZstdCompressor(level=SHEET_CSV_ZSTD_LEVEL).compressobj()
+    step = 1 << 20  # characters per slice
+    parts = [cobj.compress(text[i:i + step].encode("utf-8")) for i in range(0, len(text), step)]
+    parts.append(cobj.flush())
+    return b"".join(parts), "zstd"
+
 
-            # If upload already split it into per-sheet entries (type == 'excel_sheet'),
-            # or we only have workbook bytes, _process_excel_doc_to_chunks handles both.
-            excel_chunks = _process_excel_doc_to_chunks(doc)
+def _unpack_sheet_csv(data: bytes, codec: Optional[str]) -> bytes:
+    if codec == "zstd":
+        # decompressobj also handles frames written without a content size
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
 
-            if not excel_chunks:
-                # Fallback: if there's plain text, at least index that instead of skipping
-                doc_text = doc.get("text", "")
-                if doc_text and doc_text.strip():
-                    # Prefer chunk_document_safe if available
-                    try:
-                        from utils import chunk_document_safe
-                        doc_chunks = chunk_document_safe(doc_text, max_tokens=7500)
-                    except Exception:
-                        doc_chunks = _sliding_window_text_simple(doc_text)
-
-                    for i, piece in enumerate(doc_chunks):
-                        if not piece.strip():
-                            continue
-                        new_texts.append(piece)
-                        new_metadata.append({
-                            "type": doc.get("type", "document"),
-                            "title": f"{file_name} (Part {i+1}/{len(doc_chunks)})",
-                            "source": file_name,
-                            "sheet": None,
-                            "text": piece,
-                            "chunk_id": i
-                        })
-                else:
-                    print(f"⚠️ Skipping Excel doc with no readable content: {file_name}")
-                continue  # done with this doc
-
-            # Normal Excel handling (match build_faiss_index metadata)
-            for c in excel_chunks:
-                txt = c.get("text", "")
-                if not txt or not txt.strip():
-                    continue
-
-                new_texts.append(txt)
-                new_metadata.append({
-                    "type": c.get("type", "support_doc_table"),
-                    "title": c.get("title"),
-                    "file_name": c.get("file_name"),
-                    "source": file_name,
-                    "sheet": c.get("sheet_name") or c.get("sheet"),
-                    "sheet_name": c.get("sheet_name") or c.get("sheet"),
-                    "sheet_rows": c.get("sheet_rows"),
-                    "sheet_cols": c.get("sheet_cols"),
-                    "headers": c.get("headers"),
-                    "text": txt,
-                    "chunk_id": c.get("chunk_id"),
-                    # keep CSV bytes so that the exact sheet can be reconstructed later
-                    "sheet_csv_bytes": c.get("sheet_csv_bytes")
-                })
 
-            continue  # move on to next doc
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
 
-        # === Non-Excel documents ============================================
-        doc_text = doc.get("text", "")
-        if not doc_text or not doc_text.strip():
-            print(f"⚠️  Skipping empty document: {file_name}")
+def _docx_text(file_bytes: bytes) -> str:
+    """
+    Non-empty paragraphs of a .docx joined by blank lines, read straight from
+    word/document.xml with lxml's iterparse instead of python-docx's object model.
+    """
+    from lxml import etree
+
+    with zipfile.ZipFile(io.BytesIO(file_bytes)) as z:
+        xml = z.read("word/document.xml")
+    paragraphs = []
+    # Uploaded file: no entity expansion (XXE), no network fetches, default size limits
+    events = etree.iterparse(io.BytesIO(xml), tag=_W_NS + "p",
+                             resolve_entities=False, no_network=True, huge_tree=False)
+    for _, p in events:
+        text = "".join(p.itertext(_W_NS + "t", with_tail=False))
+        if text.strip():
+            paragraphs.append(text)
+        p.clear()  # drop parsed runs (also keeps nested paragraphs from repeating)
+    return "\n\n".join(paragraphs)
+
+
+def _pdf_text(file_bytes: bytes) -> str:
+    """
+    Page texts joined by blank lines. Uses pypdfium2 (PDFium, C++) when
+    installed, otherwise PyPDF2. Pages are read sequentially: PDFium is not
+    thread-safe, so a thread pool would have to serialize on a lock anyway.
+    """
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        import PyPDF2
+        pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_bytes))
+        return "\n\n".join(page.extract_text() or "" for page in pdf_reader.pages)
+
+    pdf = pdfium.PdfDocument(file_bytes)
+    try:
+        pages = []
+        for page in pdf:
+            textpage = page.get_textpage()
+            pages.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return "\n\n".join(pages)
+    finally:
+        pdf.close()
+
+
+# Excel-only metadata fields, kept in their own column (None for other docs)
+_EXCEL_META_FIELDS = ("file_name", "sheet_name", "sheet_rows", "sheet_cols", "headers", "sheet_csv_bytes",
+                      "sheet_csv_codec")
+_SHEET_CSV_FIELD = _EXCEL_META_FIELDS.index("sheet_csv_bytes")
+
+
+@dataclass
+class MetaColumns:
+    """
+    Chunk metadata held column-wise while documents are normalized and embedded.
+    Row dicts are only built when they are written out (rows()) or indexed.
+    """
+    texts: List[str] = field(default_factory=list)
+    types: List[str] = field(default_factory=list)
+    titles: List[Optional[str]] = field(default_factory=list)
+    sources: List[str] = field(default_factory=list)
+    sheets: List[Optional[str]] = field(default_factory=list)
+    chunk_ids: List[Optional[int]] = field(default_factory=list)
+    excel: List[Optional[Tuple[Any, ...]]] = field(default_factory=list)
+
+    def append(self, text, type, title, source, sheet=None, chunk_id=None, excel=None):
+        self.texts.append(text)
+        self.types.append(type)
+        self.titles.append(title)
+        self.sources.append(source)
+        self.sheets.append(sheet)
+        self.chunk_ids.append(chunk_id)
+        self.excel.append(excel)
+
+    def extend(self, other: "MetaColumns"):
+        self.texts.extend(other.texts)
+        self.types.extend(other.types)
+        self.titles.extend(other.titles)
+        self.sources.extend(other.sources)
+        self.sheets.extend(other.sheets)
+        self.chunk_ids.extend(other.chunk_ids)
+        self.excel.extend(other.excel)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        row = {
+            "type": self.types[i],
+            "title": self.titles[i],
+            "source": self.sources[i],
+            "sheet": self.sheets[i],
+            "text": self.texts[i],
+            "chunk_id": self.chunk_ids[i],
+        }
+        if self.excel[i] is not None:
+            row.update(zip(_EXCEL_META_FIELDS, self.excel[i]))
+        return row
+
+    def rows(self):
+        return (self[i] for i in range(len(self)))
+
+    def select(self, indices: List[int]) -> "MetaColumns":
+        return MetaColumns(*([col[i] for i in indices] for col in (
+            self.texts, self.types, self.titles, self.sources,
+            self.sheets, self.chunk_ids, self.excel
+        )))
+
+
+def _simhash64(text: str) -> int:
+    """
+    64-bit SimHash over word 3-grams (blake2b per gram). The per-bit votes
+    are counted with numpy over all grams at once.
+    """
+    words = text.lower().split()
+    grams = [" ".join(words[i:i + 3]) for i in range(max(len(words) - 2, 1))]
+    digests = b"".join(hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest() for gram in grams)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    majority = bits.sum(axis=0, dtype=np.int64) * 2 > len(grams)  # more 1s than 0s per bit
+    return int.from_bytes(np.packbits(majority, bitorder="little").tobytes(), "little")
+
+
+def _drop_near_duplicates(cols: MetaColumns) -> MetaColumns:
+    """
+    Keep the first of each group of near-identical chunks.
+    Hashes are bucketed by 16-bit band: two hashes within 3 bits of each
+    other must agree exactly on at least one of the four bands.
+    A chunk carrying its sheet's CSV bytes (a sheet's chunk 0) is always
+    kept, since no other chunk of the sheet has them.
+    """
+    bands: Dict[Tuple[int, int], List[int]] = {}
+    keep: List[int] = []
+    for i, text in enumerate(cols.texts):
+        h = _simhash64(text)
+        keys = [(b, (h >> (16 * b)) & 0xFFFF) for b in range(4)]
+        excel = cols.excel[i]
+        carries_sheet = excel is not None and excel[_SHEET_CSV_FIELD] is not None
+        if not carries_sheet and any(bin(h ^ seen).count("1") <= SIMHASH_MAX_DISTANCE
+                                     for key in keys for seen in bands.get(key, ())):
             continue
+        keep.append(i)
+        for key in keys:
+            bands.setdefault(key, []).append(h)
+    return cols if len(keep) == len(cols) else cols.select(keep)
+
+
+def _sliding_window_text_simple(text: str, size: int = 1800, overlap_chars: int = 200) -> List[str]:
+    """Overlapping character windows; the last window is the first to reach the end"""
+    if not text:
+        return []
+    step = max(1, size - overlap_chars)
+    # Start offsets stop at the first one whose window covers the end of the text
+    last_start = max(len(text) - size, 0)
+    return [text[i:i + size] for i in range(0, last_start + step, step)]
+
+
+def _chunk_text_safe(text: str, size: int = 1800, overlap_chars: int = 200) -> List[str]:
+    """chunk_document_safe (imported at the top) with character windows as the fallback"""
+    try:
+        return chunk_document_safe(text)  # ~500-token pieces, 100 tokens of overlap
+    except Exception:  # e.g. tokenizer unavailable
+        return _sliding_window_text_simple(text, size, overlap_chars)
 
-        # Prefer the same safe chunking strategy as build_faiss_index
-        try:
-            from utils import chunk_document_safe
-            doc_chunks = chunk_document_safe(doc_text, max_tokens=7500)
-        except Exception:
-            doc_chunks = _sliding_window_text_simple(doc_text)
 
-        for i, piece in enumerate(doc_chunks):
-            if not piece.strip():
+EXCEL_EXTS = (".xlsx", ".xls")
+
+
+def _is_excel_doc(doc: Dict[str, Any], file_name: str, file_ext: str) -> bool:
+    """Excel by extension/name/path, or any doc carrying raw workbook bytes"""
+    return (
+        file_ext in EXCEL_EXTS
+        or str(file_name).lower().endswith(EXCEL_EXTS)
+        or str(doc.get("file_path") or "").lower().endswith(EXCEL_EXTS)
+        or bool(doc.get("file_bytes") or doc.get("content_bytes"))
+    )
+
+
+# Skipped file names listed per reason in the summary; the rest are only counted
+SKIP_SUMMARY_MAX_NAMES = 5
+_SKIP_REASON_LABELS = {"empty": "empty documents", "unreadable": "unreadable Excel documents"}
+
+
+def _print_skip_summary(skipped: Dict[str, List[str]]) -> None:
+    """One line per skip reason (with the first few file names) instead of a print per document"""
+    for reason, names in skipped.items():
+        shown = ", ".join(names[:SKIP_SUMMARY_MAX_NAMES])
+        more = len(names) - SKIP_SUMMARY_MAX_NAMES
+        if more > 0:
+            shown += f" and {more} more"
+        print(f"⚠️  Skipped {len(names)} {_SKIP_REASON_LABELS.get(reason, reason)}: {shown}")
+
+
+def _normalize_one_doc(doc: Dict[str, Any]) -> Tuple[MetaColumns, Optional[Tuple[str, str]]]:
+    """
+    Turn one supporting document into chunk columns ready for embedding, for
+    both build_faiss_index and add_documents_to_index.
+    Excel docs get per-sheet chunks, everything else safe text chunks.
+    Pure function of the doc, so documents can be normalized in parallel.
+    Returns the columns and, for a skipped doc, (reason, file name) with
+    reason "empty" or "unreadable"; None otherwise.
+    """
+    cols = MetaColumns()
+
+    # Figure out filename / extension
+    file_name = doc.get("source") or doc.get("title") or doc.get("file_name") or "document"
+    file_ext = (doc.get("ext") or "").lower()
+    # Looked up and stripped once; both paths below test it
+    doc_text = doc.get("text") or ""
+    has_text = bool(doc_text.strip())
+
+    # Heuristic to detect Excel supporting docs (same as build_faiss_index)
+    is_excel = _is_excel_doc(doc, file_name, file_ext)
+
+    # === Excel path ======================================================
+    if is_excel:
+        print(f"📊 Detected Excel document: {file_name}")
+
+        # If upload already split it into per-sheet entries (type == 'excel_sheet'),
+        # or we only have workbook bytes, _process_excel_doc_to_chunks handles both.
+        excel_chunks = _process_excel_doc_to_chunks(doc)
+
+        for c in excel_chunks:
+            txt = c.get("text", "")
+            if not txt or not txt.strip():
                 continue
-            new_texts.append(piece)
-            new_metadata.append({
-                "type": doc.get("type", "document"),
-                "title": f"{file_name} (Part {i+1}/{len(doc_chunks)})",
-                "source": file_name,
-                "sheet": None,
-                "text": piece,
-                "chunk_id": i
-            })
+
+            sheet = c.get("sheet_name") or c.get("sheet")
+            cols.append(
+                txt,
+                type=c.get("type", "support_doc_table"),
+                title=c.get("title"),
+                source=file_name,
+                sheet=sheet,
+                chunk_id=c.get("chunk_id"),
+                # CSV bytes go to the index's sheets table (rag_index.load_sheet_csv)
+                excel=(c.get("file_name"), sheet, c.get("sheet_rows"), c.get("sheet_cols"),
+                       c.get("headers"), c.get("sheet_csv_bytes"), c.get("sheet_csv_codec"))
+            )
+
+        if excel_chunks:
+            return cols, None
+        # Fallback: if there's plain text, at least index that instead of skipping
+
+    # === Plain text (non-Excel documents and the Excel fallback) ===========
+    if not has_text:
+        return cols, ("unreadable" if is_excel else "empty", file_name)
+
+    doc_chunks = _chunk_text_safe(doc_text)
+
+    for i, piece in enumerate(doc_chunks):
+        if not piece.strip():
+            continue
+        cols.append(
+            piece,
+            type=doc.get("type", "document"),
+            title=f"{file_name} (Part {i+1}/{len(doc_chunks)})",
+            source=file_name,
+            chunk_id=i
+        )
+    return cols, None
+
+
+def _normalize_docs(docs: List[Dict[str, Any]]) -> MetaColumns:
+    """
+    _normalize_one_doc over all docs in worker threads; results keep document order.
+    (Threads rather than processes: functions defined in the Streamlit script
+    cannot be pickled for a process pool.)
+    """
+    cols = MetaColumns()
+    max_workers = min(NORMALIZE_MAX_WORKERS, len(docs)) or 1
+    skipped: Dict[str, List[str]] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for doc_cols, skip in executor.map(_normalize_one_doc, docs):
+            cols.extend(doc_cols)
+            if skip:
+                reason, file_name = skip
+                skipped.setdefault(reason, []).append(file_name)
+    _print_skip_summary(skipped)
+    return cols
+
+
+def add_documents_to_index(
+    index_path: str,
+    new_docs: List[Dict[str, Any]],
+    use_checkpoint: bool = True
+) -> None:
+    """
+    Add new documents to existing index with validation.
+    Now supports Excel (.xls/.xlsx) supporting docs in the same way
+    as build_faiss_index (per-sheet chunking + rich metadata).
+    """
+    print(f"\n➕ Adding {len(new_docs)} documents to existing index...")
+
+    # Load existing index + metadata
+    index, texts, metadata, _, _ = load_faiss_index(index_path, mmap=False)  # appended to below
+
+    print("📄 Normalizing new documents (including Excel if present)...")
+    new_cols = _normalize_docs(new_docs)
+
+    # Near-duplicate chunks (e.g. repeated sheet previews) would each cost an embedding
+    before_dedup = len(new_cols)
+    new_cols = _drop_near_duplicates(new_cols)
+    if len(new_cols) < before_dedup:
+        print(f"🧹 Skipped {before_dedup - len(new_cols)} near-duplicate segments")
+    new_texts = new_cols.texts
 
     if not new_texts:
         print("⚠️  No valid text segments to add!")
@@ -1264,40 +1659,50 @@ def add_documents_to_index(
         Path(CHECKPOINT_DIR).mkdir(parents=True, exist_ok=True)
         checkpoint_path = os.path.join(CHECKPOINT_DIR, "append_checkpoint.pkl")
 
-    try:
-        print(f"\n📊 Generating embeddings for {len(new_texts)} new segments...")
-        new_embeddings = _embed_texts_with_retry(new_texts, checkpoint_path=checkpoint_path)
+    # Embed and add one group at a time so only a group's vectors are in memory;
+    # the index file itself is only written once every group is in
+    print(f"\n📊 Generating embeddings for {len(new_texts)} new segments...")
+    added = 0
+    for start in range(0, len(new_texts), APPEND_EMBED_GROUP):
+        group = new_texts[start:start + APPEND_EMBED_GROUP]
+        try:
+            group_embeddings = _embed_texts_with_retry(group, checkpoint_path=checkpoint_path)
 
-        # Clear checkpoint on success
-        if checkpoint_path:
-            _clear_checkpoint(checkpoint_path)
+            # Clear checkpoint once the group is embedded
+            if checkpoint_path:
+                _clear_checkpoint(checkpoint_path)
 
-    except Exception as e:
-        print(f"❌ Failed to generate embeddings for new documents: {e}")
+        except Exception as e:
+            print(f"❌ Failed to generate embeddings for new documents: {e}")
 
-        if checkpoint_path and Path(checkpoint_path).exists():
-            print(f"\n💾 Checkpoint saved at: {checkpoint_path}")
-            print(f"💡 Run the append operation again to resume from checkpoint.")
+            if checkpoint_path and Path(checkpoint_path).exists():
+                print(f"\n💾 Checkpoint saved at: {checkpoint_path}")
+                print(f"💡 Run the append operation again to resume from checkpoint.")
 
-        raise
+            raise
+
+        if len(group_embeddings) == 0:
+            continue
+
+        # Add to index using FAISS
+        print(f"➕ Adding {len(group_embeddings)} vectors to existing FAISS index...")
+        add_in_batches(index, group_embeddings)  # normalizes for inner-product indexes
+        added += len(group_embeddings)
+        del group_embeddings
 
-    if len(new_embeddings) == 0:
+    if added == 0:
         print("⚠️  No embeddings generated for new documents!")
         return
 
-    # Add to index using FAISS
-    print(f"\n➕ Adding {len(new_embeddings)} vectors to existing FAISS index...")
-    index.add(new_embeddings.astype("float32"))
+    # Save updated index; append only the new metadata rows
+    # (a legacy pickle-backed index is migrated in full once)
+    meta_path = meta_db_path(index_path)
+    new_rows = list(new_cols.rows())
+    rows = new_rows if Path(meta_path).exists() else metadata + new_rows
+    save_index_and_metadata(index, index_path, lambda: append_metadata(meta_path, rows))
 
     # Update metadata list in memory
-    metadata.extend(new_metadata)
-
-    # Save updated index
-    faiss.write_index(index, index_path)
-
-    meta_path = index_path.replace(".faiss", ".meta.pkl")
-    with open(meta_path, "wb") as f:
-        pickle.dump(metadata, f)
+    metadata.extend(new_rows)
 
     print(f"✅ Updated index now has {index.ntotal} vectors")
     print(f"📝 Metadata entries now: {len(metadata)}")
@@ -1374,8 +1779,6 @@ with tab1:
 
     if support_docs:
         try:
-            from docx import Document as DocxDocument
-            import PyPDF2
             import pandas as pd
             from utils import chunk_document_safe
 
@@ -1407,17 +1810,14 @@ with tab1:
 
                 elif file_ext == '.docx':
                     try:
-                        docx = DocxDocument(io.BytesIO(file_bytes))
-                        doc_text = '\n\n'.join([para.text for para in docx.paragraphs if para.text.strip()])
+                        doc_text = _docx_text(file_bytes)
                     except Exception as e:
                         print(f"⚠️ Failed to parse DOCX {file_name}: {e}")
                         doc_text = ''
 
                 elif file_ext == '.pdf':
                     try:
-                        pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_bytes))
-                        pages = [page.extract_text() or "" for page in pdf_reader.pages]
-                        doc_text = '\n\n'.join(pages)
+                        doc_text = _pdf_text(file_bytes)
                     except Exception as e:
                         print(f"⚠️ Failed to parse PDF {file_name}: {e}")
                         doc_text = ''
@@ -1452,7 +1852,7 @@ with tab1:
                 elif file_ext == '.xlsx' or file_ext == '.xls':
                     try:
                         # Parse all sheets and create one support_doc per sheet (preserve structure)
-                        xls = pd.ExcelFile(io.BytesIO(file_bytes))
+                        xls = _open_excel(file_bytes)
                         sheet_names = xls.sheet_names
                         workbook_title = file_name
                         st.info(f"📄 {file_name}: Excel uploaded ({len(sheet_names)} sheets)")
@@ -1469,17 +1869,17 @@ with tab1:
 
                         for sheet in sheet_names:
                             try:
-                                df = pd.read_excel(io.BytesIO(file_bytes), sheet_name=sheet)
+                                df = xls.parse(sheet)  # reuse the already-loaded workbook
                                 if df is None:
                                     continue
 
-                                rows, cols = getattr(df, "shape", (0, 0))
-                                headers = list(df.columns.astype(str))
+                                rows, cols = df.shape
+                                headers = df.columns.astype(str).tolist()
 
                                 # create CSV preview text (for indexing/embedding)
                                 csv_preview = df.head(200).to_csv(index=False)  # preview first 200 rows
                                 # store full sheet as CSV bytes for later reconstruction (can be large)
-                                full_csv_bytes = df.to_csv(index=False).encode("utf-8")
+                                full_csv_bytes, csv_codec = _pack_sheet_csv(_sheet_csv_bytes(df))
 
                                 st.session_state.support_docs.append({
                                     **metadata_base,
@@ -1490,6 +1890,7 @@ with tab1:
                                     "headers": headers,
                                     "text": csv_preview,
                                     "sheet_csv_bytes": full_csv_bytes,  # full sheet CSV bytes
+                                    "sheet_csv_codec": csv_codec,  # "zstd" when compressed
                                     "file_bytes": None,  # workbook bytes already stored above if needed
                                     "chunk_id": 0
                                 })
@@ -1511,7 +1912,7 @@ with tab1:
 
                 # Chunk large text (summary/user-visible) for immediate UI and quick-search
                 if doc_text and doc_text.strip():
-                    chunks = chunk_document_safe(doc_text, max_tokens=7500)
+                    chunks = chunk_document_safe(doc_text)
                 else:
                     chunks = []
 
@@ -1585,7 +1986,7 @@ with tab1:
 
     if user_notes.strip():
         from utils import chunk_document_safe
-        chunks = chunk_document_safe(user_notes, max_tokens=7500)
+        chunks = chunk_document_safe(user_notes)
 
         
         if "support_docs" not in st.session_state:
@@ -1736,27 +2137,14 @@ def _process_excel_doc_to_chunks(doc: Dict[str, Any], max_chunk_chars: int = 180
         sheet_text = doc.get("text", "")
         if not sheet_text.strip() and doc.get("sheet_csv_bytes"):
             try:
-                sheet_text = doc["sheet_csv_bytes"].decode("utf-8", errors="ignore")
+                sheet_text = _unpack_sheet_csv(
+                    doc["sheet_csv_bytes"], doc.get("sheet_csv_codec")
+                ).decode("utf-8", errors="ignore")
             except Exception:
                 sheet_text = ""
 
         if sheet_text:
-            # Use chunk_document_safe if available
-            try:
-                from utils import chunk_document_safe
-                sub_chunks = chunk_document_safe(sheet_text, max_tokens=7500)
-            except Exception:
-                # fallback sliding window
-                def sliding_window_text(text, size=max_chunk_chars, step=None):
-                    if step is None:
-                        step = max(1, size - overlap)
-                    out = []
-                    for i in range(0, max(1, len(text)), step):
-                        out.append(text[i:i+size])
-                        if i + size >= len(text):
-                            break
-                    return out
-                sub_chunks = sliding_window_text(sheet_text, max_chunk_chars, max_chunk_chars - overlap)
+            sub_chunks = _chunk_text_safe(sheet_text, max_chunk_chars, overlap)
 
             for i, piece in enumerate(sub_chunks):
                 chunks.append({
@@ -1770,8 +2158,10 @@ def _process_excel_doc_to_chunks(doc: Dict[str, Any], max_chunk_chars: int = 180
                     "sheet_cols": sheet_cols,
                     "headers": headers,
                     "chunk_id": i,
-                    # keep original full bytes in metadata if present (useful later)
-                    "sheet_csv_bytes": doc.get("sheet_csv_bytes")
+                    # full sheet bytes, stored once per (source, sheet) in the index's
+                    # sheets table; only the sheet's first chunk carries them
+                    "sheet_csv_bytes": doc.get("sheet_csv_bytes") if i == 0 else None,
+                    "sheet_csv_codec": doc.get("sheet_csv_codec") if i == 0 else None
                 })
         return chunks
 
@@ -1790,43 +2180,26 @@ def _process_excel_doc_to_chunks(doc: Dict[str, Any], max_chunk_chars: int = 180
 
     # Parse workbook into sheets
     try:
-        sheets = pd.read_excel(io.BytesIO(excel_bytes), sheet_name=None)
-    except Exception:
-        try:
-            sheets = pd.read_excel(io.BytesIO(excel_bytes), sheet_name=None, engine="openpyxl")
-        except Exception as e:
-            print(f"⚠️ Failed to parse excel for {file_name}: {e}")
-            return chunks
+        with _open_excel(excel_bytes) as xls:
+            sheets = pd.read_excel(xls, sheet_name=None)
+    except Exception as e:
+        print(f"⚠️ Failed to parse excel for {file_name}: {e}")
+        return chunks
 
     for sheet_name, df in sheets.items():
         if df is None or df.empty:
             continue
+        rows, cols = df.shape
+        headers = df.columns.astype(str).tolist()
         try:
-            sheet_text = df.to_csv(index=False)
+            sheet_text = _sheet_csv_text(df, headers)
         except Exception:
             sheet_text = df.to_string(index=False)
 
-        rows, cols = getattr(df, "shape", (None, None))
-        headers = list(df.columns.astype(str))
-
         # chunk sheet_text (prefer chunk_document_safe)
-        try:
-            from utils import chunk_document_safe
-            sub_chunks = chunk_document_safe(sheet_text, max_tokens=7500)
-        except Exception:
-            # fallback sliding window
-            def sliding_window_text(text, size=max_chunk_chars, step=None):
-                if step is None:
-                    step = max(1, size - overlap)
-                out = []
-                for i in range(0, max(1, len(text)), step):
-                    out.append(text[i:i+size])
-                    if i + size >= len(text):
-                        break
-                return out
-            sub_chunks = sliding_window_text(sheet_text, max_chunk_chars, max_chunk_chars - overlap)
-
-        full_csv_bytes = sheet_text.encode("utf-8")
+        sub_chunks = _chunk_text_safe(sheet_text, max_chunk_chars, overlap)
+
+        full_csv_bytes, csv_codec = _pack_sheet_csv_text(sheet_text)
         for i, piece in enumerate(sub_chunks):
             chunks.append({
                 "text": piece,
@@ -1839,7 +2212,9 @@ def _process_excel_doc_to_chunks(doc: Dict[str, Any], max_chunk_chars: int = 180
                 "sheet_cols": cols,
                 "headers": headers,
                 "chunk_id": i,
-                "sheet_csv_bytes": full_csv_bytes
+                # first chunk of the sheet only (see above)
+                "sheet_csv_bytes": full_csv_bytes if i == 0 else None,
+                "sheet_csv_codec": csv_codec if i == 0 else None
             })
 
     return chunks
@@ -1861,148 +2236,25 @@ def build_faiss_index(
 
     start_time = time.time()
 
-    texts = []
-    metadata = []
-
     print(f"📦 Processing {len(chunks)} code chunks...")
-    for chunk in chunks:
-        chunk_text = chunk.get("text", "")
-        if not chunk_text or not chunk_text.strip():
-            continue
-
-        texts.append(chunk_text)
-        metadata.append({
-            "text": chunk_text,
-            "type": chunk.get("type", "code_chunk"),
-            "path": chunk.get("path", ""),
-            "kind": chunk.get("kind", "code_chunk"),
-            "hash": chunk.get("hash", ""),
-            "metrics": chunk.get("metrics", {})
-        })
+    valid = [c for c in chunks if (c.get("text") or "").strip()]
+    texts = [c["text"] for c in valid]
+    metadata = [{
+        "text": c["text"],
+        "type": c.get("type", "code_chunk"),
+        "path": c.get("path", ""),
+        "kind": c.get("kind", "code_chunk"),
+        "hash": c.get("hash", ""),
+        "metrics": c.get("metrics", {})
+    } for c in valid]
 
     # Process supporting docs
     if supporting_docs:
         print(f"📄 Adding {len(supporting_docs)} supporting documents...")
-        for doc in supporting_docs:
-            # Determine if doc is excel by extension or presence of bytes/file_path
-            file_name = doc.get("source") or doc.get("title") or doc.get("file_name") or "support_doc"
-            file_ext = (doc.get("ext") or "").lower()
-            # Heuristic: check ext or file_name suffix or presence of bytes
-            is_excel = file_ext in (".xlsx", ".xls") or str(file_name).lower().endswith((".xlsx", ".xls")) \
-                       or doc.get("file_bytes") or doc.get("content_bytes") or (doc.get("file_path") and str(doc.get("file_path")).lower().endswith((".xlsx", ".xls")))
-
-            # if is_excel:
-            #     excel_chunks = _process_excel_doc_to_chunks(doc)
-            #     if not excel_chunks:
-            #         # If parser couldn't extract sheets, fallback to any provided text
-            #         if doc.get("text") and doc.get("text").strip():
-            #             texts.append(doc.get("text"))
-            #             metadata.append({
-            #                 "type": doc.get("type", "document"),
-            #                 "title": file_name,
-            #                 "source": file_name,
-            #                 "sheet": None,
-            #                 "text": doc.get("text"),
-            #                 "chunk_id": doc.get("chunk_id", 0)
-            #             })
-            #         else:
-            #             print(f"⚠️ Skipping excel doc with no readable content: {file_name}")
-            #         continue
-
-            #     for c in excel_chunks:
-            #         txt = c.get("text", "")
-            #         if not txt or not txt.strip():
-            #             continue
-            #         texts.append(txt)
-            #         metadata.append({
-            #             "type": c.get("type", "support_doc_table"),
-            #             "title": c.get("title"),
-            #             "file_name": c.get("file_name"),
-            #             "source": file_name,
-            #             "sheet": c.get("sheet"),
-            #             "sheet_rows": c.get("sheet_rows"),
-            #             "sheet_cols": c.get("sheet_cols"),
-            #             "text": txt,
-            #             "chunk_id": c.get("chunk_id")
-            #         })
-            
-            if is_excel:
-                # If doc already has per-sheet info (created at upload), _process_excel_doc_to_chunks handles it
-                excel_chunks = _process_excel_doc_to_chunks(doc)
-                if not excel_chunks:
-                    # fallback: if doc.text exists, index that
-                    if doc.get("text") and doc.get("text").strip():
-                        texts.append(doc.get("text"))
-                        metadata.append({
-                            "type": doc.get("type", "document"),
-                            "title": file_name,
-                            "source": file_name,
-                            "sheet": None,
-                            "text": doc.get("text"),
-                            "chunk_id": doc.get("chunk_id", 0)
-                        })
-                    else:
-                        print(f"⚠️ Skipping excel doc with no readable content: {file_name}")
-                    continue
-
-                for c in excel_chunks:
-                    txt = c.get("text", "")
-                    if not txt or not txt.strip():
-                        continue
-                    texts.append(txt)
-                    # preserve structured metadata so you can reconstruct the exact sheet later
-                    metadata.append({
-                        "type": c.get("type", "support_doc_table"),
-                        "title": c.get("title"),
-                        "file_name": c.get("file_name"),
-                        "source": file_name,
-                        "sheet": c.get("sheet_name") or c.get("sheet"),
-                        "sheet_name": c.get("sheet_name") or c.get("sheet"),
-                        "sheet_rows": c.get("sheet_rows"),
-                        "sheet_cols": c.get("sheet_cols"),
-                        "headers": c.get("headers"),
-                        "text": txt,
-                        "chunk_id": c.get("chunk_id"),
-                        # persist sheet bytes for exact reconstruction if present
-                        "sheet_csv_bytes": c.get("sheet_csv_bytes")
-                    })
-
-            
-            
-            else:
-                # Not an excel file — use plain text already present or split larger text into pieces
-                doc_text = doc.get("text", "")
-                if doc_text and doc_text.strip():
-                    # prefer chunk_document_safe if available
-                    try:
-                        from utils import chunk_document_safe
-                        doc_chunks = chunk_document_safe(doc_text, max_tokens=7500)
-                    except Exception:
-                        # fallback to simple sliding window by characters
-                        def sliding_window_text_simple(text, size=1800, overlap_chars=200):
-                            step = max(1, size - overlap_chars)
-                            out = []
-                            for i in range(0, len(text), step):
-                                out.append(text[i:i+size])
-                                if i + size >= len(text):
-                                    break
-                            return out
-                        doc_chunks = sliding_window_text_simple(doc_text)
-
-                    for i, piece in enumerate(doc_chunks):
-                        if not piece.strip():
-                            continue
-                        texts.append(piece)
-                        metadata.append({
-                            "type": doc.get("type", "document"),
-                            "title": f"{file_name} (Part {i+1}/{len(doc_chunks)})",
-                            "source": file_name,
-                            "sheet": None,
-                            "text": piece,
-                            "chunk_id": i
-                        })
-                else:
-                    print(f"⚠️  Skipping empty document: {file_name}")
+        doc_cols = _normalize_docs(supporting_docs)
+        texts.extend(doc_cols.texts)
+        metadata.extend(doc_cols.rows())
+        del doc_cols
 
     if not texts:
         raise ValueError("No valid chunks or documents to index!")
@@ -2035,18 +2287,17 @@ def build_faiss_index(
     # Create FAISS index
     print(f"\n🔍 Creating FAISS index...")
     dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings.astype('float32'))
-
-    # Save index + metadata
-    print(f"💾 Saving index to {index_path}...")
     Path(index_path).parent.mkdir(parents=True, exist_ok=True)
-    faiss.write_index(index, index_path)
+    index = create_faiss_index(
+        np.ascontiguousarray(embeddings, dtype=np.float32),  # no copy when already float32
+        ivfdata_path=ivfdata_path(index_path)
+    )
 
-    meta_path = index_path.replace(".faiss", ".meta.pkl")
+    # Save index + metadata (for IVF only the header; lists are already on disk)
+    print(f"💾 Saving index to {index_path}...")
+    meta_path = meta_db_path(index_path)
     print(f"💾 Saving metadata to {meta_path}...")
-    with open(meta_path, "wb") as f:
-        pickle.dump(metadata, f)
+    save_index_and_metadata(index, index_path, lambda: write_metadata(meta_path, metadata))
 
     total_time = time.time() - start_time
     print(f"\n{'='*60}")
@@ -2065,17 +2316,16 @@ def build_faiss_index(
     else:
         print(f"✅ FAISS vectors ({index.ntotal}) perfectly match metadata entries.")
 
-    # Confirm metadata file exists and is readable
+    # Confirm metadata file exists and holds every row (counted, not reloaded)
     if not Path(meta_path).exists():
         print(f"❌ Metadata file not found at {meta_path}")
     else:
         try:
-            with open(meta_path, "rb") as f:
-                loaded_meta = pickle.load(f)
-            if len(loaded_meta) == len(metadata):
-                print(f"✅ Metadata file successfully verified ({len(loaded_meta)} entries)")
+            stored = count_metadata(meta_path)
+            if stored == len(metadata):
+                print(f"✅ Metadata file successfully verified ({stored} entries)")
             else:
-                print(f"⚠️ Metadata file entry count mismatch ({len(loaded_meta)} vs {len(metadata)})")
+                print(f"⚠️ Metadata file entry count mismatch ({stored} vs {len(metadata)})")
         except Exception as e:
             print(f"❌ Failed to read metadata file: {e}")
 
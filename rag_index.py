@@ -1,9 +1,16 @@
 # rag_index.py - COMPLETE FILE WITH TOKEN-AWARE EMBEDDING
 import os
 import pickle
+import sqlite3
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Callable
 import numpy as np
+
+# OpenMP reads this when FAISS loads: idle worker threads sleep instead of
+# spinning, which otherwise makes small adds/searches burn every core
+os.environ.setdefault("OMP_WAIT_POLICY", "PASSIVE")
 import faiss
 from openai import AzureOpenAI
 from rank_bm25 import BM25Okapi
@@ -13,6 +20,33 @@ import re
 # ============================================================
 EMB_DEPLOY = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "text-embedding-ada-002")
 API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2023-05-15")
+# Most texts sent in one embeddings request (token budget permitting)
+EMBED_BATCH_SIZE = 64
+# Embedding requests kept in flight at once (bounded by the deployment's rate limit)
+EMBED_MAX_WORKERS = int(os.getenv("EMBED_MAX_WORKERS", "4"))
+# Indexes with at least this many vectors are built as IVF (partitioned)
+# instead of flat; below it, exhaustive search is already fast
+IVF_MIN_VECTORS = int(os.getenv("FAISS_IVF_MIN_VECTORS", "20000"))
+# index_factory key for small (exhaustive) indexes. SQfp16 stores half-precision
+# vectors: half the bytes of "Flat" (full float32) at practically the same
+# recall, and it needs no training. Avoid SQ8 here: it learns per-dimension
+# ranges from the first (possibly tiny) build and clamps vectors appended later
+FLAT_INDEX_KEY = os.getenv("FAISS_FLAT_INDEX_KEY", "SQfp16")
+# Inverted lists probed per query on IVF indexes
+IVF_NPROBE = int(os.getenv("FAISS_IVF_NPROBE", "16"))
+# index_factory key for large indexes; must have an IVF stage. The default
+# stores fp16 codes, for the same reason as FLAT_INDEX_KEY: appends are encoded
+# with ranges fixed at build time; e.g. "OPQ32,IVF{nlist},PQ32" trades much
+# more accuracy for memory
+IVF_INDEX_KEY = os.getenv("FAISS_IVF_INDEX_KEY", "IVF{nlist},SQfp16")
+# Most vectors used to train the IVF coarse quantizer (random sample beyond this)
+IVF_TRAIN_MAX = 256_000
+# Vectors passed to one index.add call; bounds FAISS's per-call scratch
+# (list assignments, encoded codes) on very large builds
+INDEX_ADD_BATCH = 100_000
+# OpenMP threads FAISS uses for training, adds and searches (default: all cores)
+FAISS_OMP_THREADS = int(os.getenv("FAISS_OMP_THREADS", str(os.cpu_count() or 1)))
+faiss.omp_set_num_threads(FAISS_OMP_THREADS)
 
 
 # ============================================================
@@ -63,7 +97,7 @@ def _get_client() -> AzureOpenAI:
 # ============================================================
 # TOKEN-AWARE EMBEDDING FUNCTION
 # ============================================================
-def _embed_texts(texts: List[str]) -> np.ndarray:
+def _embed_texts(texts: List[str], batch_size: int = EMBED_BATCH_SIZE, out_path: str = None) -> np.ndarray:
     """
     Embed texts in batches with token-aware processing.
     
@@ -73,13 +107,15 @@ def _embed_texts(texts: List[str]) -> np.ndarray:
     - Individual texts that exceed limit are truncated
     
     Strategy:
-    - Process texts in batches
+    - Process texts in batches of up to batch_size texts
     - Track cumulative tokens per batch
-    - Keep batch under 6000 tokens (safe margin)
+    - Keep batch under 4000 tokens (safe margin)
     - Truncate individual texts if needed
+    - Send up to EMBED_MAX_WORKERS batch requests concurrently
+    - Write each batch straight into one preallocated float32 matrix
+      (a memory-mapped .npy at out_path when given, so it need not fit in RAM)
     """
     client = _get_client()
-    all_vecs = []
     
     if not texts:
         return np.array([])
@@ -88,6 +124,7 @@ def _embed_texts(texts: List[str]) -> np.ndarray:
     MAX_TOKENS_PER_BATCH = 4000  # Reduced from 6000 - safer limit
     MAX_TOKENS_PER_TEXT = 4500   # Reduced from 7000 - max tokens for a single text
     
+    batches = []  # (start offset, texts, estimated tokens)
     current_batch = []
     current_tokens = 0
     
@@ -103,46 +140,114 @@ def _embed_texts(texts: List[str]) -> np.ndarray:
             text = truncate_to_tokens(text, MAX_TOKENS_PER_TEXT)
             text_tokens = estimate_tokens(text)  # Recalculate after truncation
         
-        # Check if adding this text would exceed batch limit
-        if current_tokens + text_tokens > MAX_TOKENS_PER_BATCH and current_batch:
-            # Process current batch
-            print(f"  Processing batch: {len(current_batch)} texts, ~{current_tokens} tokens")
-            try:
-                resp = client.embeddings.create(model=EMB_DEPLOY, input=current_batch)
-                batch_vecs = np.array([r.embedding for r in resp.data])
-                all_vecs.append(batch_vecs)
-            except Exception as e:
-                print(f"❌ Error embedding batch: {e}")
-                print(f"   Batch had {len(current_batch)} texts with ~{current_tokens} tokens")
-                raise
-            
-            # Start new batch
-            current_batch = [text]
-            current_tokens = text_tokens
-        else:
-            current_batch.append(text)
-            current_tokens += text_tokens
+        # Close the current batch if this text would overflow it
+        if current_batch and (current_tokens + text_tokens > MAX_TOKENS_PER_BATCH
+                              or len(current_batch) >= batch_size):
+            batches.append((idx - len(current_batch), current_batch, current_tokens))
+            current_batch = []
+            current_tokens = 0
+        
+        current_batch.append(text)
+        current_tokens += text_tokens
     
-    # Process final batch
+    # Final batch
     if current_batch:
-        print(f"  Processing final batch: {len(current_batch)} texts, ~{current_tokens} tokens")
+        batches.append((len(texts) - len(current_batch), current_batch, current_tokens))
+    
+    def embed_batch(i: int) -> Tuple[int, List[List[float]]]:
+        start, batch, batch_tokens = batches[i]
+        label = "final batch" if i == len(batches) - 1 else f"batch {i+1}/{len(batches)}"
+        print(f"  Processing {label}: {len(batch)} texts, ~{batch_tokens} tokens")
         try:
-            resp = client.embeddings.create(model=EMB_DEPLOY, input=current_batch)
-            batch_vecs = np.array([r.embedding for r in resp.data])
-            all_vecs.append(batch_vecs)
+            resp = client.embeddings.create(model=EMB_DEPLOY, input=batch)
         except Exception as e:
-            print(f"❌ Error embedding final batch: {e}")
-            print(f"   Batch had {len(current_batch)} texts with ~{current_tokens} tokens")
+            print(f"❌ Error embedding {label}: {e}")
+            print(f"   Batch had {len(batch)} texts with ~{batch_tokens} tokens")
             raise
-    
-    result = np.vstack(all_vecs) if all_vecs else np.array([])
-    print(f"✅ Created {result.shape[0]} embeddings (dim={result.shape[1] if len(result.shape) > 1 else 0})")
+        return start, [r.embedding for r in resp.data]
+    
+    result = None  # (len(texts), dim) float32, allocated once the dimension is known
+    with ThreadPoolExecutor(max_workers=min(EMBED_MAX_WORKERS, len(batches))) as executor:
+        for start, vectors in executor.map(embed_batch, range(len(batches))):
+            if result is None:
+                shape = (len(texts), len(vectors[0]))
+                if out_path:
+                    result = np.lib.format.open_memmap(out_path, mode="w+", dtype=np.float32, shape=shape)
+                else:
+                    result = np.empty(shape, dtype=np.float32)
+            result[start:start + len(vectors)] = vectors
+    
+    print(f"✅ Created {result.shape[0]} embeddings (dim={result.shape[1]})")
     return result
 
 
 # ============================================================
 # FAISS Index Building
 # ============================================================
+def ivfdata_path(index_path: str) -> str:
+    """On-disk inverted lists file of an IVF index at index_path"""
+    return str(Path(index_path).with_suffix(".ivfdata"))
+
+
+def _embeddings_path(index_path: str) -> str:
+    """Scratch .npy the build streams embeddings into (removed once indexed)"""
+    return str(Path(index_path).with_suffix(".emb.npy"))
+
+
+def add_in_batches(index: faiss.Index, embeddings: np.ndarray, normalize: bool = True) -> None:
+    """
+    index.add over row slices (views, no copies) of INDEX_ADD_BATCH vectors.
+    Inner-product indexes get unit-length vectors (normalized in place).
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)  # no copy when already float32
+    normalize = normalize and index.metric_type == faiss.METRIC_INNER_PRODUCT
+    for start in range(0, len(embeddings), INDEX_ADD_BATCH):
+        batch = embeddings[start:start + INDEX_ADD_BATCH]
+        if normalize:
+            faiss.normalize_L2(batch)
+        index.add(batch)
+
+
+def create_faiss_index(embeddings: np.ndarray, ivfdata_path: str = None) -> faiss.Index:
+    """
+    Create and fill an inner-product index over the L2-normalized embeddings
+    (normalized in place); on unit vectors this ranks exactly like L2.
+    Small corpora get an exhaustive index (FLAT_INDEX_KEY); large ones an IVF
+    index (IVF_INDEX_KEY) with ~4*sqrt(n) lists, trained on at most
+    IVF_TRAIN_MAX of the vectors. Both default to fp16 scalar-quantized codes,
+    which keep distances close enough for hybrid scoring.
+    With ivfdata_path, IVF lists live in that memory-mapped file: later adds
+    write only the new codes there and write_index saves just the header.
+    """
+    n, dim = embeddings.shape
+    faiss.normalize_L2(embeddings)
+    if n < IVF_MIN_VECTORS:
+        index = faiss.index_factory(dim, FLAT_INDEX_KEY, faiss.METRIC_INNER_PRODUCT)
+        if not index.is_trained:  # e.g. an SQ8 key set through the environment
+            index.train(embeddings[:IVF_TRAIN_MAX])
+    else:
+        nlist = int(4 * np.sqrt(n))
+        index_key = IVF_INDEX_KEY.format(nlist=nlist)
+        train = embeddings
+        if n > IVF_TRAIN_MAX:
+            sample = np.sort(np.random.default_rng(0).choice(n, IVF_TRAIN_MAX, replace=False))
+            train = embeddings[sample]
+        print(f"🧭 Training {index_key} index on {len(train)} of {n} vectors...")
+        index = faiss.index_factory(dim, index_key, faiss.METRIC_INNER_PRODUCT)
+        index.train(train)
+        ivf = faiss.extract_index_ivf(index)
+        ivf.nprobe = IVF_NPROBE  # saved with the index
+        ivf.parallel_mode = 1  # thread over inverted lists, not just over queries
+        if ivfdata_path:
+            Path(ivfdata_path).unlink(missing_ok=True)
+            # The index stores this path verbatim: keep it valid from any working directory
+            invlists = faiss.OnDiskInvertedLists(ivf.nlist, ivf.code_size, os.path.abspath(ivfdata_path))
+            ivf.replace_invlists(invlists, True)
+            invlists.this.disown()  # owned by the index now
+    add_in_batches(index, embeddings, normalize=False)  # already normalized above
+    return index
+
+
 # def build_faiss_index(
 #     chunks: List[Dict[str, Any]],
 #     index_path: str,
@@ -247,31 +352,24 @@ def build_faiss_index(
     total_start = time.time()
     print(f"\n🔨 Building FAISS index from {len(chunks)} chunks...")
 
-    # Prepare texts and metadata
-    texts = []
-    metadata = []
-
-    # Add code chunks
-    for chunk in chunks:
-        texts.append(chunk["text"])
-        metadata.append({
-            "type": "code",
-            "file": chunk.get("file", "unknown"),
-            "hash": chunk.get("hash", ""),
-            "text": chunk["text"]
-        })
-
-    # Add supporting documents if provided
+    # Prepare texts and metadata (each list built at its final size)
+    supporting_docs = supporting_docs or []
     if supporting_docs:
         print(f"📄 Adding {len(supporting_docs)} supporting documents...")
-        for doc in supporting_docs:
-            texts.append(doc["text"])
-            metadata.append({
-                "type": "document",
-                "title": doc.get("title", "Unknown Document"),
-                "source": doc.get("source", ""),
-                "text": doc["text"]
-            })
+    texts = [chunk["text"] for chunk in chunks] + [doc["text"] for doc in supporting_docs]
+
+    # Code chunks, then supporting documents
+    metadata = [{
+        "type": "code",
+        "file": chunk.get("file", "unknown"),
+        "hash": chunk.get("hash", ""),
+        "text": chunk["text"]
+    } for chunk in chunks] + [{
+        "type": "document",
+        "title": doc.get("title", "Unknown Document"),
+        "source": doc.get("source", ""),
+        "text": doc["text"]
+    } for doc in supporting_docs]
 
     if not texts:
         print("⚠️  No texts to embed!")
@@ -280,10 +378,13 @@ def build_faiss_index(
     # Generate embeddings with token awareness
     print(f"\n🧮 Generating embeddings for {len(texts)} texts...")
     embed_start = time.time()
+    Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+    embeddings_path = _embeddings_path(index_path)
     try:
-        embeddings = _embed_texts(texts)
+        embeddings = _embed_texts(texts, out_path=embeddings_path)
     except Exception as e:
         print(f"❌ Failed to generate embeddings: {e}")
+        Path(embeddings_path).unlink(missing_ok=True)
         raise
     embed_time = time.time() - embed_start
     print(f"⏱️ Embedding generation took {embed_time:.2f} seconds")
@@ -292,24 +393,28 @@ def build_faiss_index(
     print(f"\n🔍 Creating FAISS index...")
     build_start = time.time()
     dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings.astype('float32'))
+    index = create_faiss_index(
+        np.ascontiguousarray(embeddings, dtype=np.float32),  # no copy when already float32
+        ivfdata_path=ivfdata_path(index_path)
+    )
+    del embeddings  # unmap before removing the scratch file
+    Path(embeddings_path).unlink(missing_ok=True)
     build_time = time.time() - build_start
     print(f"⏱️ FAISS index creation took {build_time:.2f} seconds")
 
     # Save index and metadata
     print(f"💾 Saving index to {index_path}...")
-    Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+    meta_path = meta_db_path(index_path)
+    print(f"💾 Saving metadata to {meta_path}...")
 
-    faiss.write_index(index, index_path)
-    try:
-        meta_path = index_path.replace(".faiss", ".meta.pkl")
-        print(f"💾 Saving metadata to {meta_path}...")
-        with open(meta_path, "wb") as f:
-            pickle.dump(metadata, f)
-    except Exception as e:
-        print(f"❌ Failed to save metadata: {e}")
-        # raise
+    def write_meta():
+        try:
+            write_metadata(meta_path, metadata)
+        except Exception as e:
+            print(f"❌ Failed to save metadata: {e}")
+            # raise
+
+    save_index_and_metadata(index, index_path, write_meta)
 
     total_time = time.time() - total_start
     print(f"✅ Index built successfully!")
@@ -320,23 +425,172 @@ def build_faiss_index(
 
     return index, metadata
 
+# ============================================================
+# Metadata Store (append-only SQLite, one pickled row per vector)
+# ============================================================
+# zlib level for metadata rows: chunk text dominates and deflates ~3x for
+# little CPU, while disk I/O is what large appends/loads wait on
+META_ZLIB_LEVEL = 1
+
+
+def _encode_meta_row(m: Dict[str, Any]) -> bytes:
+    return zlib.compress(pickle.dumps(m, protocol=pickle.HIGHEST_PROTOCOL), META_ZLIB_LEVEL)
+
+
+def _decode_meta_row(data: bytes) -> Dict[str, Any]:
+    # Rows written before compression are bare pickles (protocol >= 2 starts with 0x80)
+    if data[:1] == b"\x80":
+        return pickle.loads(data)
+    return pickle.loads(zlib.decompress(data))
+
+
+def _split_sheet_csv(m: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[Tuple[Any, Any, Optional[str], bytes]]]:
+    """
+    Move a row's full-sheet CSV bytes out to the sheets table, keyed by the
+    row's source and sheet, so metadata rows (loaded on every start) skip them.
+    """
+    if "sheet_csv_bytes" not in m:
+        return m, None
+    row = {k: v for k, v in m.items() if k not in ("sheet_csv_bytes", "sheet_csv_codec")}
+    data = m["sheet_csv_bytes"]
+    if data is None:
+        return row, None
+    return row, (m.get("source"), m.get("sheet"), m.get("sheet_csv_codec"), data)
+
+
+def meta_db_path(index_path: str) -> str:
+    """SQLite metadata store of the index at index_path"""
+    return str(Path(index_path).with_suffix(".meta.db"))
+
+
+def index_artifact_paths(index_path: str) -> List[str]:
+    """
+    Every file an index at index_path may own: the index itself, its SQLite
+    metadata store (with WAL files), the legacy metadata pickle, the IVF
+    on-disk lists and the build's scratch embeddings.
+    """
+    meta_db = meta_db_path(index_path)
+    return [
+        index_path,
+        meta_db, meta_db + "-wal", meta_db + "-shm",
+        index_path.replace(".faiss", ".meta.pkl"),
+        ivfdata_path(index_path),
+        _embeddings_path(index_path),
+    ]
+
+
+def _connect_meta_db(meta_db: str) -> sqlite3.Connection:
+    con = sqlite3.connect(meta_db)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("CREATE TABLE IF NOT EXISTS meta (id INTEGER PRIMARY KEY, data BLOB NOT NULL)")
+    con.execute("CREATE TABLE IF NOT EXISTS sheets (source TEXT, sheet TEXT, codec TEXT, data BLOB NOT NULL, "
+                "PRIMARY KEY (source, sheet))")
+    return con
+
+
+def append_metadata(meta_db: str, rows: List[Dict[str, Any]]) -> None:
+    """
+    Append metadata rows after the existing ones. Row ids follow insertion
+    order, so they stay aligned with the FAISS vector ids.
+    """
+    encoded, sheets = [], []
+    for m in rows:
+        row, sheet = _split_sheet_csv(m)
+        encoded.append((_encode_meta_row(row),))
+        if sheet is not None:
+            sheets.append(sheet)
+    con = _connect_meta_db(meta_db)
+    try:
+        with con:
+            # A re-uploaded sheet replaces the stored copy
+            con.executemany("INSERT OR REPLACE INTO sheets (source, sheet, codec, data) VALUES (?, ?, ?, ?)", sheets)
+            con.executemany("INSERT INTO meta (data) VALUES (?)", encoded)
+    finally:
+        con.close()
+
+
+def write_metadata(meta_db: str, metadata: List[Dict[str, Any]]) -> None:
+    """Replace the whole metadata store (used when an index is rebuilt)."""
+    for suffix in ("", "-wal", "-shm"):
+        Path(meta_db + suffix).unlink(missing_ok=True)
+    append_metadata(meta_db, metadata)
+
+
+def save_index_and_metadata(index: faiss.Index, index_path: str, write_meta: Callable[[], None]) -> None:
+    """
+    faiss.write_index alongside write_meta() on a second thread. They touch
+    disjoint files and both release the GIL while writing, so the save
+    phase takes the longer of the two instead of their sum.
+    """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        index_future = executor.submit(faiss.write_index, index, index_path)
+        meta_future = executor.submit(write_meta)
+        index_future.result()
+        meta_future.result()
+
+
+def _load_metadata(meta_db: str) -> List[Dict[str, Any]]:
+    con = _connect_meta_db(meta_db)
+    try:
+        return [_decode_meta_row(data) for (data,) in con.execute("SELECT data FROM meta ORDER BY id")]
+    finally:
+        con.close()
+
+
+def count_metadata(meta_db: str) -> int:
+    """Rows in the metadata store, counted by SQLite without decoding any"""
+    con = _connect_meta_db(meta_db)
+    try:
+        return con.execute("SELECT COUNT(*) FROM meta").fetchone()[0]
+    finally:
+        con.close()
+
+
+def load_sheet_csv(index_path: str, source: str, sheet: str) -> Tuple[Optional[bytes], Optional[str]]:
+    """Full CSV (data, codec) of a metadata row's source and sheet; (None, None) if not stored."""
+    con = _connect_meta_db(meta_db_path(index_path))
+    try:
+        row = con.execute("SELECT data, codec FROM sheets WHERE source = ? AND sheet = ?", (source, sheet)).fetchone()
+    finally:
+        con.close()
+    return (row[0], row[1]) if row else (None, None)
+
+
 # ============================================================
 # FAISS Index Loading
 # ============================================================
-def load_faiss_index(index_path: str):
+def load_faiss_index(index_path: str, mmap: bool = False):
+    """
+    Load the index and its metadata. With mmap an exhaustive index is
+    memory-mapped read-only, so the OS pages it in on demand. IVF indexes with
+    an .ivfdata file are always read normally: their lists are already mapped
+    from that file, and FAISS crashes searching them under IO_FLAG_MMAP.
+    """
     if not Path(index_path).exists():
         raise FileNotFoundError(f"Index not found: {index_path}")
     
     print(f"📂 Loading FAISS index from {index_path}...")
-    index = faiss.read_index(index_path)
-    
-    meta_path = index_path.replace(".faiss", ".meta.pkl")
-    if not Path(meta_path).exists():
+    index = None
+    if mmap and not Path(ivfdata_path(index_path)).exists():
+        try:
+            index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:  # index types this FAISS build cannot map
+            print(f"⚠️ Could not memory-map index ({e}); reading it into RAM")
+    if index is None:
+        index = faiss.read_index(index_path)
+    
+    meta_path = meta_db_path(index_path)
+    legacy_meta_path = index_path.replace(".faiss", ".meta.pkl")
+    if Path(meta_path).exists():
+        metadata = _load_metadata(meta_path)
+    elif Path(legacy_meta_path).exists():
+        # Indexes built before the SQLite store; migrated on the next append
+        meta_path = legacy_meta_path
+        with open(meta_path, "rb") as f:
+            metadata = pickle.load(f)
+    else:
         raise FileNotFoundError(f"Metadata not found: {meta_path}")
-    
-    with open(meta_path, "rb") as f:
-        metadata = pickle.load(f)
-        print(f"📂 Loaded metadata from {meta_path} with {len(metadata)} entries")
+    print(f"📂 Loaded metadata from {meta_path} with {len(metadata)} entries")
     
     texts = [m.get("text", "") for m in metadata]
     tokenized = None
@@ -432,11 +686,21 @@ def semantic_search(
     # --- FAISS Semantic Search ---
     resp = client.embeddings.create(model=EMB_DEPLOY, input=[query_text])
     query_vec = np.array([resp.data[0].embedding], dtype='float32')
+    ivf = faiss.try_extract_index_ivf(index)
+    is_ip = index.metric_type == faiss.METRIC_INNER_PRODUCT
+    if is_ip:
+        faiss.normalize_L2(query_vec)
+    if ivf is not None:
+        ivf.nprobe = IVF_NPROBE  # IVF indexes: lists searched per query
+        ivf.parallel_mode = 1  # one query at a time, so spread its lists over threads
     distances, indices = index.search(query_vec, top_k*2)  # get more for hybrid ranking
 
     sem_results = {}
     for rank, (dist, idx) in enumerate(zip(distances[0], indices[0])):
-        if idx < len(metadata):
+        if 0 <= idx < len(metadata):  # IVF returns -1 when fewer than k hits
+            if is_ip:
+                # cosine -> squared L2 between unit vectors, so scores match older L2 indexes
+                dist = max(2.0 - 2.0 * dist, 0.0)
             sem_results[idx] = 1 / (dist + 1e-6)  # convert distance to score
 
     # --- BM25 Search ---
@@ -478,7 +742,7 @@ def add_documents_to_index(
     print(f"\n➕ Adding {len(new_docs)} documents to existing index...")
     
     # Load existing index
-    index, metadata = load_faiss_index(index_path)
+    index, _, metadata, _, _ = load_faiss_index(index_path, mmap=False)
     
     # Prepare new texts
     texts = [doc["text"] for doc in new_docs]
@@ -487,22 +751,21 @@ def add_documents_to_index(
     new_embeddings = _embed_texts(texts)
     
     # Add to index
-    index.add(new_embeddings.astype('float32'))
+    add_in_batches(index, new_embeddings)
     
     # Update metadata
-    for doc in new_docs:
-        metadata.append({
-            "type": "document",
-            "title": doc.get("title", "Unknown"),
-            "source": doc.get("source", ""),
-            "text": doc["text"]
-        })
-    
-    # Save updated index
-    faiss.write_index(index, index_path)
-    meta_path = index_path.replace(".index", ".meta.pkl")
-    with open(meta_path, "wb") as f:
-        pickle.dump(metadata, f)
+    new_metadata = [{
+        "type": "document",
+        "title": doc.get("title", "Unknown"),
+        "source": doc.get("source", ""),
+        "text": doc["text"]
+    } for doc in new_docs]
+    
+    # Save updated index; only the new metadata rows are written
+    # (a legacy pickle-backed index is migrated in full once)
+    meta_path = meta_db_path(index_path)
+    rows = new_metadata if Path(meta_path).exists() else metadata + new_metadata
+    save_index_and_metadata(index, index_path, lambda: append_metadata(meta_path, rows))
     
     print(f"✅ Updated index now has {index.ntotal} vectors")
 
@@ -65,11 +65,12 @@ with st.sidebar:
 
     # --- Index clearing ---
     if clear_index:
-        meta_path = index_path.replace(".faiss", ".meta.pkl")
-        if os.path.exists(index_path):
-            os.remove(index_path)
-            if os.path.exists(meta_path):
-                os.remove(meta_path)
+        # Metadata store, IVF lists etc. too, so a rebuild never meets stale rows
+        from rag_index import index_artifact_paths
+        artifacts = [path for path in index_artifact_paths(index_path) if os.path.exists(path)]
+        if artifacts:
+            for path in artifacts:
+                os.remove(path)
             st.success(f"✅ Cleared index at {index_dir}")
             st.rerun()
         else:
@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+import rag_index
+
+
+def _embeddings(rng, base, n):
+    # Real embeddings share a common direction; spread them around one.
+    return (base + 0.3 * rng.standard_normal((n, base.shape[0]))).astype("float32")
+
+
+def test_flat_index_recall_after_append():
+    rng = np.random.default_rng(0)
+    base = rng.standard_normal(256).astype("float32")
+    first = _embeddings(rng, base, 5)
+    appended = _embeddings(rng, base, 2000)
+
+    index = rag_index.create_faiss_index(first.copy())
+    rag_index.add_in_batches(index, appended.copy())
+
+    exact = faiss.IndexFlatIP(base.shape[0])
+    rag_index.add_in_batches(exact, np.vstack([first, appended]))
+
+    queries = _embeddings(rng, base, 100)
+    faiss.normalize_L2(queries)
+    _, truth = exact.search(queries, 5)
+    _, found = index.search(queries, 5)
+    recall = np.mean([len(set(t) & set(f)) / 5 for t, f in zip(truth, found)])
+    assert recall >= 0.95
+
+
+def test_ivf_index_recall_after_append(monkeypatch):
+    monkeypatch.setattr(rag_index, "IVF_MIN_VECTORS", 100)
+    rng = np.random.default_rng(0)
+    base = rng.standard_normal(128).astype("float32")
+    # Trained on a tight first batch; later appends spread wider
+    first = (base + 0.1 * rng.standard_normal((300, 128))).astype("float32")
+    appended = _embeddings(rng, base, 2000)
+
+    index = rag_index.create_faiss_index(first.copy())
+    rag_index.add_in_batches(index, appended.copy())
+    ivf = faiss.extract_index_ivf(index)
+    ivf.nprobe = ivf.nlist  # measure code accuracy, not list probing
+
+    exact = faiss.IndexFlatIP(base.shape[0])
+    rag_index.add_in_batches(exact, np.vstack([first, appended]))
+
+    queries = _embeddings(rng, base, 100)
+    faiss.normalize_L2(queries)
+    _, truth = exact.search(queries, 5)
+    _, found = index.search(queries, 5)
+    recall = np.mean([len(set(t) & set(f)) / 5 for t, f in zip(truth, found)])
+    assert recall >= 0.99
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_ivf_index_reload_and_search(tmp_path, monkeypatch, mmap):
+    monkeypatch.setattr(rag_index, "IVF_MIN_VECTORS", 100)
+    index_path = str(tmp_path / "code.faiss")
+    vectors = np.random.default_rng(0).standard_normal((2000, 64)).astype("float32")
+
+    index = rag_index.create_faiss_index(
+        vectors.copy(), ivfdata_path=rag_index.ivfdata_path(index_path)
+    )
+    meta_path = rag_index.meta_db_path(index_path)
+    rows = [{"type": "code", "text": str(i)} for i in range(len(vectors))]
+    rag_index.save_index_and_metadata(
+        index, index_path, lambda: rag_index.write_metadata(meta_path, rows)
+    )
+    del index
+
+    loaded, texts, _, _, _ = rag_index.load_faiss_index(index_path, mmap=mmap)
+    assert loaded.ntotal == len(vectors) == len(texts)
+    queries = vectors[:20].copy()
+    faiss.normalize_L2(queries)
+    _, found = loaded.search(queries, 1)
+    assert (found[:, 0] == np.arange(20)).mean() >= 0.9
+
+
+def test_index_artifact_paths_cover_saved_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag_index, "IVF_MIN_VECTORS", 100)
+    index_path = str(tmp_path / "index.faiss")
+    vectors = np.random.default_rng(0).standard_normal((500, 32)).astype("float32")
+
+    index = rag_index.create_faiss_index(
+        vectors, ivfdata_path=rag_index.ivfdata_path(index_path)
+    )
+    meta_path = rag_index.meta_db_path(index_path)
+    rows = [{"type": "code", "text": str(i)} for i in range(len(vectors))]
+    rag_index.save_index_and_metadata(
+        index, index_path, lambda: rag_index.write_metadata(meta_path, rows)
+    )
+
+    artifacts = set(rag_index.index_artifact_paths(index_path))
+    assert {str(p) for p in tmp_path.iterdir()} <= artifacts
+
+
+def test_ivf_index_loads_from_another_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag_index, "IVF_MIN_VECTORS", 100)
+    (tmp_path / "store").mkdir()
+    (tmp_path / "elsewhere").mkdir()
+    monkeypatch.chdir(tmp_path)
+    index_path = "store/index.faiss"  # relative, as the sidebar builds it
+    vectors = np.random.default_rng(0).standard_normal((500, 32)).astype("float32")
+
+    index = rag_index.create_faiss_index(
+        vectors.copy(), ivfdata_path=rag_index.ivfdata_path(index_path)
+    )
+    meta_path = rag_index.meta_db_path(index_path)
+    rows = [{"type": "code", "text": str(i)} for i in range(len(vectors))]
+    rag_index.save_index_and_metadata(
+        index, index_path, lambda: rag_index.write_metadata(meta_path, rows)
+    )
+    del index
+
+    monkeypatch.chdir(tmp_path / "elsewhere")
+    loaded, _, _, _, _ = rag_index.load_faiss_index(str(tmp_path / index_path))
+    queries = vectors[:10].copy()
+    faiss.normalize_L2(queries)
+    _, found = loaded.search(queries, 1)
+    assert (found[:, 0] == np.arange(10)).mean() >= 0.9
+
+
+def test_sheet_csv_kept_out_of_metadata_rows(tmp_path):
+    index_path = str(tmp_path / "index.faiss")
+    meta_path = rag_index.meta_db_path(index_path)
+    sheet = {"source": "book.xlsx", "sheet": "Orders", "chunk_id": 0,
+             "sheet_csv_bytes": b"id,total\n1,5\n", "sheet_csv_codec": None}
+    rest = {"source": "book.xlsx", "sheet": "Orders", "chunk_id": 1,
+            "sheet_csv_bytes": None, "sheet_csv_codec": None}
+    rag_index.write_metadata(meta_path, [sheet, rest])
+    rag_index.append_metadata(meta_path, [dict(sheet, sheet_csv_bytes=b"id,total\n2,7\n")])
+
+    rows = rag_index._load_metadata(meta_path)
+    assert len(rows) == 3
+    assert not any("sheet_csv_bytes" in row for row in rows)
+    assert rag_index.load_sheet_csv(index_path, "book.xlsx", "Orders") == (b"id,total\n2,7\n", None)
+    assert rag_index.load_sheet_csv(index_path, "book.xlsx", "Missing") == (None, None)
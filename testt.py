@@ -152,7 +152,7 @@ with tab1:
 
                 # Chunk large text (summary/user-visible) for immediate UI and quick-search
                 if doc_text and doc_text.strip():
-                    chunks = chunk_document_safe(doc_text, max_tokens=7500)
+                    chunks = chunk_document_safe(doc_text)
                 else:
                     chunks = []
 
@@ -226,7 +226,7 @@ with tab1:
 
     if user_notes.strip():
         from utils import chunk_document_safe
-        chunks = chunk_document_safe(user_notes, max_tokens=7500)
+        chunks = chunk_document_safe(user_notes)
 
         
         if "support_docs" not in st.session_state:
@@ -440,17 +440,16 @@ def build_faiss_index(
                     # prefer chunk_document_safe if available
                     try:
                         from utils import chunk_document_safe
-                        doc_chunks = chunk_document_safe(doc_text, max_tokens=7500)
+                        doc_chunks = chunk_document_safe(doc_text)
                     except Exception:
                         # fallback to simple sliding window by characters
                         def sliding_window_text_simple(text, size=1800, overlap_chars=200):
+                            if not text:
+                                return []
                             step = max(1, size - overlap_chars)
-                            out = []
-                            for i in range(0, len(text), step):
-                                out.append(text[i:i+size])
-                                if i + size >= len(text):
-                                    break
-                            return out
+                            # starts stop at the first window that reaches the end
+                            last_start = max(len(text) - size, 0)
+                            return [text[i:i+size] for i in range(0, last_start + step, step)]
                         doc_chunks = sliding_window_text_simple(doc_text)
 
                     for i, piece in enumerate(doc_chunks):
@@ -614,16 +613,16 @@ def _process_excel_doc_to_chunks(doc: Dict[str, Any], max_chunk_chars: int = 180
         # Use chunk_document_safe if available (preferred)
         try:
             from utils import chunk_document_safe
-            sub_chunks = chunk_document_safe(sheet_text, max_tokens=7500)  # maintain parity with app.py
+            sub_chunks = chunk_document_safe(sheet_text)  # maintain parity with app.py
         except Exception:
             # fallback sliding window approach in chars
             def sliding_window_text(text, size=max_chunk_chars, step=None):
                 if step is None:
                     step = max(1, size - overlap)
-                for i in range(0, max(1, len(text)), step):
+                # starts stop at the first window that reaches the end
+                last_start = max(len(text) - size, 0)
+                for i in range(0, last_start + step, step):
                     yield text[i:i+size]
-                    if i + size >= len(text):
-                        break
             sub_chunks = list(sliding_window_text(sheet_text, max_chunk_chars, max_chunk_chars - overlap))
 
         if not sub_chunks:
@@ -313,17 +313,19 @@ def _force_split_large_chunk(text: str, target_tokens: int, overlap: int) -> Lis
 
 def _get_overlap_lines(lines: List[str], overlap_chars: int) -> List[str]:
     """Get last few lines that fit in overlap size"""
-    overlap_lines = []
+    # Walk back to the first line that still fits, then slice once
+    # (instead of inserting each line at the front)
+    start = len(lines)
     overlap_size = 0
     
-    for line in reversed(lines):
-        line_size = len(line) + 1
+    while start > 0:
+        line_size = len(lines[start - 1]) + 1
         if overlap_size + line_size > overlap_chars:
             break
-        overlap_lines.insert(0, line)
         overlap_size += line_size
+        start -= 1
     
-    return overlap_lines
+    return lines[start:]
 
 
 def _token_aware_character_chunk(text: str, target_tokens: int, overlap: int) -> List[str]:
@@ -359,4 +361,46 @@ def validate_chunk_size(chunk: str, max_tokens: int = 800) -> bool:
     if tokens > max_tokens:
         print(f"⚠️ Warning: Chunk has {tokens} tokens (max: {max_tokens})")
         return False
-    return True
\ No newline at end of file
+    return True
+
+# ============================================================
+# ✅ NEW: EXACT TOKEN CHUNKING FOR SUPPORTING DOCUMENTS
+# ============================================================
+
+_DOC_ENCODING = None
+
+
+def _doc_encoding():
+    """cl100k_base (the embedding model's tokenizer), loaded on first use"""
+    global _DOC_ENCODING
+    if _DOC_ENCODING is None:
+        import tiktoken
+        _DOC_ENCODING = tiktoken.get_encoding("cl100k_base")
+    return _DOC_ENCODING
+
+
+def chunk_document_safe(text: str, max_tokens: int = 500, overlap_tokens: int = 100) -> List[str]:
+    """
+    Split a document into overlapping pieces of at most max_tokens real tokens,
+    consecutive pieces sharing overlap_tokens. The defaults give retrieval-sized
+    pieces (~1800 characters); pass a larger max_tokens for coarser chunks.
+    Tokenizes once with tiktoken (Rust) and cuts the original string at the
+    character offsets of token boundaries, so limits are exact, not estimated.
+    """
+    if not text or not text.strip():
+        return []
+    enc = _doc_encoding()
+    tokens = enc.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return [text]
+    _, offsets = enc.decode_with_offsets(tokens)
+    step = max(1, max_tokens - overlap_tokens)
+    pieces = []
+    for start in range(0, len(tokens), step):
+        end = start + max_tokens
+        piece = text[offsets[start]:offsets[end] if end < len(tokens) else len(text)]
+        if piece.strip():
+            pieces.append(piece)
+        if end >= len(tokens):
+            break
+    return pieces